@@ -1,7 +1,8 @@
 #!/usr/bin/env python 
+import functools
 import os
-import base64
-import io 
+import tempfile
+import time
 
 import dash 
 from dash import dcc, html, dash_table
@@ -12,13 +13,63 @@ from dash.exceptions import PreventUpdate
 
 import dash_bootstrap_components as dbc
 
-import pandas as pd
+import flask
 
-from utility_funcs import save_parameters_values, save_t_values, t_value_func, plot_func
-from utility_funcs import generate_values, generate_values_1st, generate_values_2nd
-from utility_funcs import save_infer_values, save_t_values, save_parameters_values
+
+# the app, its prefetch workers and its export job workers are separate
+# processes that share fits through one sqlite fit cache, kept next to the
+# job queue unless GCURVE_FIT_CACHE_PATH names another file (empty: fits stay
+# in each process's memory and exports refit every plant). set before
+# utility_funcs is imported, which opens the cache
+jobs_dir = os.environ.get("GCURVE_JOBS_DIR") or os.path.join(tempfile.gettempdir(), "gcurve-jobs")
+os.makedirs(jobs_dir, exist_ok=True)
+os.environ.setdefault("GCURVE_FIT_CACHE_PATH", os.path.join(jobs_dir, "fits.sqlite"))
+
+import instrumentation
+from dataset_store import DatasetStore
+from ingest import read_upload
+from utility_funcs import (
+        GridSpec, default_grid, default_y_range, figure_signature, fit_plant, incremental_fits, plant_figure,
+        plant_figure_patch, refit_incremental,
+        )
+from exports import available_formats, export_formats, export_kinds
+from export_jobs import JobRunner
+from figures import marker_visibility
+from prefetch import Prefetcher
 # initialize application
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+server = app.server
+
+# GCURVE_DEBUG_PANEL=1 shows the stage timings under the graphs (and turns
+# the instrumentation on, see instrumentation.py)
+debug_panel = os.environ.get("GCURVE_DEBUG_PANEL", "0") == "1"
+if debug_panel:
+    instrumentation.enable()
+
+# uploaded datasets live server side, the browser only keeps their key.
+# GCURVE_DTYPE=float32 halves their memory
+dataset_dtype = os.environ.get("GCURVE_DTYPE", "float64")
+# trace the peak allocation of each upload parse (slows parsing down)
+trace_uploads = os.environ.get("GCURVE_TRACE_UPLOADS", "0") == "1"
+dataset_store = DatasetStore(
+        directory=os.environ.get("GCURVE_DATA_DIR"),
+        ttl=int(os.environ.get("GCURVE_DATASET_TTL", 7200)),
+        )
+# every upload is fitted in the background, plants near the slider first.
+# GCURVE_PREFETCH_WORKERS=0 turns it off
+prefetcher = Prefetcher(
+        workers=int(os.environ.get("GCURVE_PREFETCH_WORKERS", max(1, (os.cpu_count() or 1) - 1))),
+        )
+# GCURVE_INCREMENTAL=1 (incremental_fits): an upload that appends time points
+# to a stored dataset refits the plants fitted before from their previous
+# parameters, or keeps them if the new points lie on their curves (refit_incremental)
+
+# whole-dataset exports run as background jobs in worker processes
+job_runner = JobRunner(
+        directory=jobs_dir,
+        dataset_dir=dataset_store.directory,
+        workers=int(os.environ.get("GCURVE_JOB_WORKERS", 1)),
+        )
 
 # create html session 
 ########################################################################################
@@ -75,6 +126,75 @@ threshold_value = html.Div(
             }
         )
 
+### evaluation grid 
+grid_options = html.Div(
+        children=[ 
+            html.P(children="Grid End (days) / Points: ", style={"textAlign": "center"}),
+            html.Div(
+                children=[ 
+                    dcc.Input(
+                        id="grid-stop",
+                        type="number",
+                        value=default_grid.stop,
+                        min=1,
+                        step=1,
+                        style={"width": "50%"},
+                        ),
+                    dcc.Input(
+                        id="grid-points",
+                        type="number",
+                        value=default_grid.num,
+                        min=10,
+                        step=10,
+                        style={"width": "50%"},
+                        ),
+                    ],
+                style={"display": "flex"},
+                ),
+            dcc.Checklist(
+                id="grid-adaptive",
+                options=[{"label": " Adaptive sampling", "value": "adaptive"}],
+                value=[],
+                ),
+            ],
+        style={
+            "width": "100%",
+            "display": "flex",
+            "flex-direction": "column",
+            "margin-top": "10px",
+            }
+        )
+
+### y axis range of the growth function, autoscaled when either end is empty
+y_range_options = html.Div(
+        children=[ 
+            html.P(children="Y Range (min / max): ", style={"textAlign": "center"}),
+            html.Div(
+                children=[ 
+                    dcc.Input(
+                        id="y-min",
+                        type="number",
+                        value=default_y_range[0],
+                        style={"width": "50%"},
+                        ),
+                    dcc.Input(
+                        id="y-max",
+                        type="number",
+                        value=default_y_range[1],
+                        style={"width": "50%"},
+                        ),
+                    ],
+                style={"display": "flex"},
+                ),
+            ],
+        style={
+            "width": "100%",
+            "display": "flex",
+            "flex-direction": "column",
+            "margin-top": "10px",
+            }
+        )
+
 ### plant sliderbar 
 slidebar_plant_num = html.Div(
         children=[ 
@@ -99,12 +219,21 @@ download_options = html.Div(
                 children="Download Options", 
                 style={"textAlign": "center", "color": "white"}),
             dcc.Dropdown(
-                options=["Inferred_Values", "T_Values", "Parameters_Values"],
+                options=export_kinds,
                 # value="T_Values",
                 multi=False,
                 searchable=False,
                 id="download-options"
                 ),
+            dcc.Dropdown(
+                options=available_formats(),
+                value="csv",
+                multi=False,
+                searchable=False,
+                clearable=False,
+                id="download-format",
+                style={"margin-top": "10px"},
+                ),
             ],
         style={
             "margin-top": "200px",
@@ -116,7 +245,12 @@ download_options = html.Div(
 ### download result 
 download_result = html.Div(
         children=[ 
-            html.Button(children=["Download CSV"], id="download-button"),
+            html.Button(children=["Download"], id="download-button"),
+            html.Button(children=["Cancel"], id="cancel-button", style={"margin-left": "5px"}),
+            html.Div(id="export-progress", style={"margin-top": "10px"}),
+            html.Div(id="export-cancelled", style={"display": "none"}),
+            dcc.Store(id="export-job"),
+            dcc.Interval(id="export-interval", interval=500, disabled=True),
             dcc.Download(id="download-csv"),
             ],
         style={
@@ -147,6 +281,8 @@ sidebar = html.Div(
             upload_dataset,
             html.Hr(),
             threshold_value,
+            grid_options,
+            y_range_options,
             slidebar_plant_num,
             loading_indicator,
             download_options,
@@ -197,6 +333,21 @@ result_graphs = html.Div(
                     "height": "80vh",
                     },
                 ),
+            # skeleton the browser's figure was built on and the t markers it
+            # shows, see update_graph
+            dcc.Store(id="figure-signature"),
+            dcc.Store(id="figure-markers"),
+            ],
+        )
+
+
+### stage timings, cache hit rates and fit counts (GCURVE_DEBUG_PANEL)
+timing_panel = html.Div(
+        children=[
+            html.Hr(),
+            html.H6(children="Timings"),
+            html.Pre(id="timing-report", style={"fontSize": "0.8rem"}),
+            dcc.Interval(id="timing-interval", interval=2000),
             ],
         )
 
@@ -209,7 +360,7 @@ main_page = html.Div(
             result_table,
             html.Hr(),
             result_graphs,
-            ],
+            ] + ([timing_panel] if debug_panel else []),
         style={
             "margin-left": "18rem",
             "margin-right": "2rem",
@@ -229,25 +380,85 @@ app.layout = html.Div(
         )
 
 
+# instrumentation
+## callbacks are timed as "callback.<name>"; the rest of their request, mostly
+## Dash decoding the inputs and JSON-encoding the outputs, as "serialize"
+def timed_callback(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if flask.has_request_context():
+                flask.g.callback_seconds = seconds
+            instrumentation.record(f"callback.{func.__name__}", seconds)
+    return wrapper
+
+
+@server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@server.after_request
+def record_request(response):
+    if instrumentation.enabled and "callback_seconds" in flask.g:
+        seconds = time.perf_counter() - flask.g.request_start
+        instrumentation.record(
+                "serialize", seconds - flask.g.callback_seconds, bytes=response.content_length,
+                )
+        instrumentation.count("response_bytes", response.content_length or 0)
+    return response
+
+
+## prometheus-style scrape endpoint
+@server.route("/metrics")
+def metrics():
+    return flask.Response(instrumentation.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
 # utilities function 
 ## upload function 
 def parse_contents(contents, filename):
-    content_type, content_string = contents.split(",")
-
-    deconded = base64.b64decode(content_string)
     try:
-        if "csv" in filename:
-            # assume that the user uploaded a csv file 
-            df = pd.read_csv(io.StringIO(deconded.decode("utf-8")))
-        elif "xls" in filename:
-            # assume that the user uploaded an excel file 
-            df = pd.read_excel(io.BytesIO(deconded))
+        data, report = read_upload(contents, filename, dtype=dataset_dtype, measure_memory=trace_uploads)
     except Exception as e:
         print(e)
         return html.Div(children=["There was an error processing this file."])
     else:
-        df = df.dropna()
-        return df.to_dict("series")
+        print(report.summary())
+        return data, report
+
+
+## look up the uploaded dataset by the key kept in memory-output
+def load_dataset(key):
+    if key is None:
+        raise PreventUpdate
+    data = dataset_store.get(key)
+    if data is None:
+        # expired or unknown key, the file has to be uploaded again
+        raise PreventUpdate
+    return data
+
+
+## evaluation grid from the sidebar inputs
+def grid_spec(stop, points, adaptive):
+    if not stop or not points or stop <= 0 or points < 2:
+        raise PreventUpdate
+    return GridSpec(start=0.0, stop=float(stop), num=int(points), adaptive=bool(adaptive))
+
+
+# None (autorange) unless both ends are set
+def y_range(low, high):
+    if low is None or high is None:
+        return None
+    if low >= high:
+        raise PreventUpdate
+    return (float(low), float(high))
 
 
 # callback function 
@@ -255,15 +466,32 @@ def parse_contents(contents, filename):
 ### upload function
 @app.callback(
         Output(component_id="memory-output", component_property="data"),
+        Output(component_id="upload-filename", component_property="children"),
         [
             Input(component_id="upload-dataset", component_property="contents"),
             State(component_id="upload-dataset", component_property="filename"),
+            State(component_id="slidebar-plant-num", component_property="value"),
             ]
         )
-def update_dataset(list_of_contents, list_of_names):
-    if list_of_contents is not None:
-        df = parse_contents(list_of_contents, list_of_names)
-        return df
+@timed_callback
+def update_dataset(list_of_contents, list_of_names, plant_index):
+    if list_of_contents is None:
+        raise PreventUpdate
+    parsed = parse_contents(list_of_contents, list_of_names)
+    if not isinstance(parsed, tuple):
+        return dash.no_update, parsed
+    data, report = parsed
+    summary = [report.summary()]
+    previous = dataset_store.find_extended(data) if incremental_fits else None
+    if previous is not None:
+        incremental = refit_incremental(previous, data)
+        print(incremental.summary())
+        summary += [html.Br(), incremental.summary()]
+    key = dataset_store.put(data)
+    # the slider keeps its position across uploads; that plant is fitted by
+    # update_graph, the prefetch works outwards from it
+    prefetcher.start(key, data, focus=min(plant_index or 0, len(data.names) - 1))
+    return key, html.Small(children=summary)
 
 
 ### slidarbar
@@ -273,9 +501,8 @@ def update_dataset(list_of_contents, list_of_names):
             Input(component_id="memory-output",  component_property="data"),
             ]
         )
-def update_slidebar(data):
-    if data is None:
-        raise PreventUpdate
+def update_slidebar(key):
+    data = load_dataset(key)
     max_num = len(data) - 2
     return max_num
 
@@ -288,14 +515,14 @@ def update_slidebar(data):
             Input(component_id="slidebar-plant-num", component_property="value"), 
             ]
         )
-def update_plant_num(data, value):
-    if data is None: 
-        raise PreventUpdate
+def update_plant_num(key, value):
+    data = load_dataset(key)
    
     keys = list(data.keys()).copy()
     keys.remove("x")
 
     plant_number = keys[value]
+    prefetcher.focus(key, value)
     return plant_number
 
 
@@ -303,72 +530,134 @@ def update_plant_num(data, value):
 @app.callback(
         Output(component_id="t-table", component_property="data"),
         Output(component_id="result-graphs", component_property="figure"),
+        Output(component_id="figure-signature", component_property="data"),
+        Output(component_id="figure-markers", component_property="data"),
         [ 
             Input(component_id="memory-output", component_property="data"), 
             Input(component_id="plant-number", component_property="children"), 
             Input(component_id="threshold-value", component_property="value"), 
+            Input(component_id="grid-stop", component_property="value"), 
+            Input(component_id="grid-points", component_property="value"), 
+            Input(component_id="grid-adaptive", component_property="value"), 
+            Input(component_id="y-min", component_property="value"), 
+            Input(component_id="y-max", component_property="value"), 
+            State(component_id="figure-signature", component_property="data"),
+            State(component_id="figure-markers", component_property="data"),
             ]
         )
-def update_graph(data, children, value):
-    if data is None:
-        raise PreventUpdate
-
-    values = generate_values(data["x"], data[children])
-    values_1 = generate_values_1st(data["x"], data[children])
-    values_2 = generate_values_2nd(data["x"], data[children])
-    # values, values_1, values_2 = infer_values(data["x"], data[children])
+@timed_callback
+def update_graph(key, children, value, stop, points, adaptive, y_min, y_max, signature, shown):
+    data = load_dataset(key)
+
+    # fit, grids, t values and figure are each cached, a threshold change
+    # only recomputes the t values and the figure. a plant the prefetcher is
+    # fitting right now is waited for, any other uncached one is fitted here
+    prefetcher.wait(key, children)
+    fit = fit_plant(data["x"], data[children], grid=grid_spec(stop, points, adaptive))
     
-    t_values = t_value_func(values_1, values_2, value)
-    t_values = pd.DataFrame(t_values)
-    t_values.insert(0, "name", ["day", "growth rate"])
-    t_table = t_values.to_dict("records")
+    t_values = fit.t_values(value)
+    t_table = [
+            {"name": row, **{name: t_values[name][i] for name in t_values}}
+            for i, row in enumerate(["day", "growth rate"])
+            ]
+
+    # the full figure is only sent when the browser has no figure on the same
+    # skeleton yet; otherwise a patch replaces just the data arrays and t
+    # markers, and shows / hides only the markers that change
+    y_limits = y_range(y_min, y_max)
+    new_signature = figure_signature(fit, y_limits)
+    markers = marker_visibility(t_values)
+    if signature == new_signature:
+        patch = plant_figure_patch(data["x"], data[children], fit, value, y_range=y_limits, shown=shown)
+        return t_table, patch, signature, markers
 
-    fig = plot_func(data["x"], data[children], values, values_1, values_2, value)
+    fig = plant_figure(data["x"], data[children], fit, value, y_range=y_limits)
 
-    return t_table, fig
+    return t_table, fig, new_signature, markers
 
+### download data 
+# clicking the button queues the export as a background job (or reuses a
+# finished one); export-interval then polls its progress
 @app.callback(
+        Output(component_id="export-job", component_property="data"),
+        Output(component_id="export-interval", component_property="disabled"),
         Output(component_id="loading-output", component_property="children"),
         [ 
-            Input(component_id="memory-output", component_property="data"),
-            Input(component_id="download-options", component_property="value"),
-            Input(component_id="threshold-value", component_property="value"),
-            ]
+            Input(component_id="download-button", component_property="n_clicks"),
+            State(component_id="memory-output", component_property="data"),
+            State(component_id="download-options", component_property="value"),
+            State(component_id="download-format", component_property="value"),
+            State(component_id="threshold-value", component_property="value"),
+            State(component_id="grid-stop", component_property="value"), 
+            State(component_id="grid-points", component_property="value"), 
+            State(component_id="grid-adaptive", component_property="value"), 
+            ],
+        prevent_initial_call=True,
         )
-def update_download_options(data, value, threshold):
-    if data is None: 
+@timed_callback
+def start_export(n_clicks, key, value, fmt, threshold, stop, points, adaptive):
+    if value not in export_kinds or fmt not in export_formats:
         raise PreventUpdate
+    load_dataset(key)
+    grid = grid_spec(stop, points, adaptive)
 
-    if os.path.exists("my_file.pkl"):
-        os.remove("my_file.pkl")
-
-    if value == "T_Values":
-        df = save_t_values(data, threshold)
-        df.to_pickle("my_file.pkl")
-    elif value == "Parameters_Values":
-        df = save_parameters_values(data)
-        df.to_pickle("my_file.pkl")
-    elif value == "Inferred_Values":
-        df = save_infer_values(data)
-        df.to_pickle("my_file.pkl")
-    else:
-        pass
-    return value
+    job_id = job_runner.submit(key, value, threshold, grid, fmt)
+    return job_id, False, value
 
-### download data 
+
+### export progress, sends the file once the job is done 
 @app.callback(
+        Output(component_id="export-progress", component_property="children"),
         Output(component_id="download-csv", component_property="data"),
-        [ Input(component_id="download-button", component_property="n_clicks") ],
+        Output(component_id="export-interval", component_property="disabled"),
+        [ 
+            Input(component_id="export-interval", component_property="n_intervals"),
+            State(component_id="export-job", component_property="data"),
+            ],
         prevent_initial_call=True,
         )
-def download_data(n_clicks):
-    try:
-        df = pd.read_pickle("my_file.pkl")
-    except Exception as e:
+@timed_callback
+def poll_export(n_intervals, job_id):
+    job = job_runner.status(job_id) if job_id else None
+    if job is None:
+        return "", dash.no_update, True
+
+    if job["status"] == "done":
+        filename = job["kind"] + export_formats[job["format"]]
+        return "Export ready", dcc.send_file(job["result_path"], filename), True
+    elif job["status"] == "failed":
+        return f"Export failed: {job['error']}", dash.no_update, True
+    elif job["status"] == "cancelled":
+        return "Export cancelled", dash.no_update, True
+    elif job["status"] == "queued":
+        return "Export queued", dash.no_update, False
+    return f"Plants done: {job['done']} / {job['total']}", dash.no_update, False
+
+
+### cancel export 
+@app.callback(
+        Output(component_id="export-cancelled", component_property="children"),
+        [ 
+            Input(component_id="cancel-button", component_property="n_clicks"),
+            State(component_id="export-job", component_property="data"),
+            ],
+        prevent_initial_call=True,
+        )
+def cancel_export(n_clicks, job_id):
+    if not job_id:
         raise PreventUpdate
-    else: 
-        os.remove("my_file.pkl")
-        return dcc.send_data_frame(df.to_csv, "my_file.csv")
+    job_runner.cancel(job_id)
+    return job_id
+
+
+### timing panel
+if debug_panel:
+    @app.callback(
+            Output(component_id="timing-report", component_property="children"),
+            Input(component_id="timing-interval", component_property="n_intervals"),
+            )
+    def update_timing_report(n_intervals):
+        return instrumentation.text_report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+# outcome of levenberg_marquardt for every plant (rows). converged plants
+# met ftol or xtol; the others ran out of iterations or hit non-finite values
+class BatchFit(NamedTuple):
+    params: np.ndarray
+    covariance: np.ndarray
+    sse: np.ndarray
+    n_obs: np.ndarray
+    converged: np.ndarray
+    nfev: np.ndarray
+    njev: np.ndarray
+
+
+# levenberg-marquardt on many plants sharing one x vector at once: a
+# (plants x params) parameter array, (plants x points) residuals and
+# (plants x points x params) jacobians, with one batched linear solve per
+# iteration. model is a growth_models.GrowthModel (func and jac broadcast over
+# parameter columns), ys a (plants x points) array where nan marks a missing
+# point of that plant, p0 / lower / upper (plants x params). steps are clipped
+# to the bounds. a plant leaves the active set once the relative drop of its
+# residual sum of squares is below ftol or its step below xtol relative to
+# its parameters, as in minpack. the covariance is curve_fit's:
+# pinv(J^T J) * sse / (n_obs - params)
+def levenberg_marquardt(model, x, ys, p0, lower, upper, max_iterations=200, ftol=1e-8, xtol=1e-8):
+    x = np.asarray(x, dtype=float)
+    ys = np.atleast_2d(np.asarray(ys, dtype=float))
+    n_plants, n_params = ys.shape[0], np.shape(p0)[-1]
+    observed = np.isfinite(ys) & np.isfinite(x)
+    ys = np.where(observed, ys, 0.0)
+    x = np.where(np.isfinite(x), x, 1.0)
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (n_plants, n_params))
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (n_plants, n_params))
+
+    def residuals(rows, params):
+        with np.errstate(all="ignore"):
+            r = model.func(x, *params.T[:, :, None]) - ys[rows]
+        r = np.where(observed[rows], r, 0.0)
+        sse = np.sum(r**2, axis=1)
+        return r, np.where(np.isfinite(sse), sse, np.inf)
+
+    def normal_equations(rows):
+        jac = model.jac(x, *params[rows].T[:, :, None])
+        jac = np.where(observed[rows, :, None], jac, 0.0)
+        jtj[rows] = np.einsum("pnk,pnl->pkl", jac, jac)
+        gradient[rows] = np.einsum("pnk,pn->pk", jac, r[rows])
+        njev[rows] += 1
+
+    params = np.clip(np.asarray(p0, dtype=float), lower, upper)
+    everyone = np.arange(n_plants)
+    r, sse = residuals(everyone, params)
+    nfev = np.ones(n_plants, dtype=int)
+    njev = np.zeros(n_plants, dtype=int)
+    jtj = np.zeros((n_plants, n_params, n_params))
+    gradient = np.zeros((n_plants, n_params))
+    damping = np.full(n_plants, 1e-3)
+    converged = np.zeros(n_plants, dtype=bool)
+
+    active = everyone[np.isfinite(sse)]
+    normal_equations(active)
+    for _ in range(max_iterations):
+        finite = np.all(np.isfinite(jtj[active]), axis=(1, 2)) & np.all(np.isfinite(gradient[active]), axis=1)
+        active = active[finite]
+        if not active.size:
+            break
+
+        # marquardt's scaling by the diagonal, floored so flat directions stay solvable
+        a = jtj[active]
+        diagonal = np.einsum("pkk->pk", a)
+        diagonal = np.maximum(diagonal, 1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300)
+        lhs = a + damping[active, None, None] * diagonal[:, :, None] * np.eye(n_params)
+        step = _solve(lhs, -gradient[active])
+
+        old = params[active]
+        new = np.clip(old + step, lower[active], upper[active])
+        new_r, new_sse = residuals(active, new)
+        nfev[active] += 1
+
+        accepted = new_sse < sse[active]
+        drop = (sse[active] - new_sse) / np.maximum(sse[active], np.finfo(float).tiny)
+        moved = np.linalg.norm(new - old, axis=1)
+        done = (moved <= xtol * (xtol + np.linalg.norm(old, axis=1))) | (accepted & (drop <= ftol))
+        done &= np.all(np.isfinite(step), axis=1)
+
+        rows = active[accepted]
+        params[rows], r[rows], sse[rows] = new[accepted], new_r[accepted], new_sse[accepted]
+        damping[rows] = np.maximum(damping[rows] / 3, 1e-12)
+        damping[active[~accepted]] *= 4
+        converged[active[done]] = True
+        active = active[~done]
+        normal_equations(np.intersect1d(rows, active))
+
+    n_obs = observed.sum(axis=1)
+    fitted = everyone[converged]
+    normal_equations(fitted)
+    covariance = np.full((n_plants, n_params, n_params), np.inf)
+    dof = n_obs[fitted] - n_params
+    if fitted.size:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(dof > 0, sse[fitted] / dof, np.inf)
+            covariance[fitted] = np.linalg.pinv(jtj[fitted]) * scale[:, None, None]
+    return BatchFit(params, covariance, sse, n_obs, converged, nfev, njev)
+
+
+# batched solve of the damped normal equations; a singular system only
+# gives that plant a nan step instead of failing the batch
+def _solve(lhs, rhs):
+    try:
+        return np.linalg.solve(lhs, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        step = np.full(rhs.shape, np.nan)
+        for i in range(len(lhs)):
+            try:
+                step[i] = np.linalg.solve(lhs[i], rhs[i])
+            except np.linalg.LinAlgError:
+                pass
+        return step
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# benchmarks for fitting, grid evaluation, t values, figures and the save_*
+# exports on synthetic plates drawn from known 5pl parameters plus noise.
+#
+#   python bench.py --plants 20 100 --grid-points 130 1300 --save bench_baseline.json
+#   python bench.py --plants 20 100 --grid-points 130 1300 --compare bench_baseline.json
+#
+# every case reports the median wall time of --repeat runs and the peak
+# memory traced (tracemalloc) in one more run. --compare flags cases that are
+# slower or use more memory than the baseline by more than --tolerance and
+# exits with 1 if any did
+
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import utility_funcs
+from dataset_store import Dataset
+from growth_models import five_log_func
+from utility_funcs import (
+        GridSpec, curve_fitting, figure_cache, fit_cache, fit_plant, fit_plants, generate_values, generate_values_1st,
+        generate_values_2nd, plant_figure, plot_func, save_infer_values, save_parameters_values,
+        save_t_values, t_value_func, t_values_batch,
+        )
+
+
+# changes below these are noise whatever the ratio
+min_seconds = 0.002
+min_bytes = 256 * 1024
+
+
+# plate of plants with 5pl parameters drawn around those of the test data
+# and gaussian noise on every observation; returns the dataset and the
+# true (plants x 5) parameters
+def synthetic_dataset(plants, observations=25, noise=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.round(np.linspace(10, 115, observations))
+    params = np.column_stack([
+            rng.uniform(-1, 1, plants),      # a
+            rng.uniform(3, 6, plants),       # b
+            rng.uniform(50, 120, plants),    # c
+            rng.uniform(95, 100, plants),    # d
+            rng.uniform(1, 15, plants),      # g
+            ])
+    values = five_log_func(x, *(p[:, None] for p in params.T))
+    values = values + rng.normal(0, noise, values.shape)
+    names = [f"plant_{i}" for i in range(plants)]
+    return Dataset(x, names, values), params
+
+
+# (name, depends on the grid, setup, run) for one plate. setup runs before
+# every measured run and is not timed: "cold" empties the caches, "warm"
+# leaves only the fits in the fit cache, so grids, t values and figures are
+# computed again
+def benchmark_cases(data, grid, threshold=0.005):
+    x = data.x
+    columns = [data[name] for name in data.names]
+    fitted = {}
+    grids = []
+
+    def cold():
+        fit_cache.clear()
+        figure_cache.clear()
+
+    def warm():
+        if not fitted:
+            cold()
+            for y in columns:
+                fit = fit_plant(x, y)
+                fitted[fit.key] = fit
+        cold()
+        # copies drop the evaluated grids and t values, see FitResult.__getstate__
+        for key, fit in fitted.items():
+            fit_cache.put(key, copy.deepcopy(fit))
+
+    def evaluated():
+        if not grids:
+            warm()
+            for y in columns:
+                fit = fit_plant(x, y, grid=grid)
+                grids.append((y, fit.interval, fit.values, fit.values_1st, fit.values_2nd))
+
+    def evaluate_all():
+        for y in columns:
+            generate_values(x, y, grid)
+            generate_values_1st(x, y, grid)
+            generate_values_2nd(x, y, grid)
+
+    def t_values_all():
+        for _, interval, _, values_1st, values_2nd in grids:
+            t_value_func(values_1st, values_2nd, threshold, interval)
+
+    def t_values_plate():
+        t_values_batch(
+                np.vstack([g[3] for g in grids]), np.vstack([g[4] for g in grids]),
+                threshold, np.vstack([g[1] for g in grids]),
+                )
+
+    def figures_all():
+        for y, interval, values, values_1st, values_2nd in grids:
+            plot_func(x, y, values, values_1st, values_2nd, threshold, interval=interval)
+
+    def app_figures_all():
+        for y in columns:
+            plant_figure(x, y, fit_plant(x, y, grid=grid), threshold)
+
+    return [
+            ("curve_fitting", False, cold, lambda: [curve_fitting(x, y) for y in columns]),
+            ("fit_plants", False, cold, lambda: fit_plants(x, dict(zip(data.names, columns)))),
+            ("generate_values", True, warm, evaluate_all),
+            ("t_value_func", True, evaluated, t_values_all),
+            ("t_values_batch", True, evaluated, t_values_plate),
+            ("plot_func", True, evaluated, figures_all),
+            ("plant_figure", True, warm, app_figures_all),
+            ("save_infer_values", True, warm, lambda: save_infer_values(data, grid=grid)),
+            ("save_t_values", True, warm, lambda: save_t_values(data, threshold, grid=grid)),
+            ("save_parameters_values", False, warm, lambda: save_parameters_values(data)),
+            ]
+
+
+# median wall time of repeat runs and the traced peak of one more run
+def measure(setup, run, repeat):
+    seconds = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(seconds), "min_seconds": min(seconds), "peak_bytes": peak}
+
+
+def run_benchmarks(args):
+    # first-call costs (lazy imports of scipy, plotly and the pandas the
+    # save_* cases use, the figure skeleton) are not part of any case
+    warm_up, _ = synthetic_dataset(1, seed=args.seed)
+    fit = fit_plant(warm_up.x, warm_up.values[0])
+    plot_func(warm_up.x, warm_up.values[0], fit.values, fit.values_1st, fit.values_2nd)
+    save_parameters_values(warm_up)
+
+    results = {}
+    for plants in args.plants:
+        data, _ = synthetic_dataset(plants, args.observations, args.noise, args.seed)
+        for i, points in enumerate(args.grid_points):
+            grid = GridSpec(stop=129.0, num=points)
+            for name, grid_dependent, setup, run in benchmark_cases(data, grid):
+                if args.cases and not any(pattern in name for pattern in args.cases):
+                    continue
+                if not grid_dependent and i > 0:
+                    continue
+                case = f"{name}[plants={plants}" + (f",grid={points}]" if grid_dependent else "]")
+                results[case] = measure(setup, run, args.repeat)
+                print(f"{case:55s} {results[case]['seconds']:9.4f}s {results[case]['peak_bytes'] / 2**20:8.1f} MB",
+                      flush=True)
+    return results
+
+
+def machine_info():
+    return {
+            "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            }
+
+
+# cases slower or larger than in baseline by more than tolerance
+def regressions(results, baseline, tolerance):
+    flagged = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        slower = result["seconds"] - base["seconds"]
+        if slower > min_seconds and result["seconds"] > base["seconds"] * (1 + tolerance):
+            flagged.append(f"{case}: {base['seconds']:.4f}s -> {result['seconds']:.4f}s "
+                           f"(+{slower / base['seconds']:.0%})")
+        larger = result["peak_bytes"] - base["peak_bytes"]
+        if larger > min_bytes and result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+            flagged.append(f"{case}: peak {base['peak_bytes'] / 2**20:.1f} MB -> "
+                           f"{result['peak_bytes'] / 2**20:.1f} MB (+{larger / base['peak_bytes']:.0%})")
+    return flagged
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the gcurve pipeline on synthetic plates.")
+    parser.add_argument("--plants", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--grid-points", type=int, nargs="+", default=[130, 1300])
+    parser.add_argument("--observations", type=int, default=25, help="time points per plant")
+    parser.add_argument("--noise", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", nargs="*", help="only cases whose name contains one of these")
+    parser.add_argument("--fit-mode", choices=["default", "guided"], default="default")
+    parser.add_argument("--solver", choices=["pool", "batched"], default="pool")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline json")
+    parser.add_argument("--compare", metavar="PATH", help="baseline json to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown / growth, 0.25 = 25%%")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    utility_funcs.default_fit_mode = args.fit_mode
+    utility_funcs.default_solver = args.solver
+    # benchmarks measure the code, not the pool
+    utility_funcs.batch_executor = "serial"
+
+    results = run_benchmarks(args)
+    report = {
+            "machine": machine_info(),
+            "settings": {
+                "observations": args.observations, "noise": args.noise, "seed": args.seed,
+                "repeat": args.repeat, "fit_mode": args.fit_mode, "solver": args.solver,
+                },
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+            }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != report["machine"]:
+            print("note: the baseline was recorded on a different machine / environment")
+        flagged = regressions(results, baseline["results"], args.tolerance)
+        for line in flagged:
+            print(f"REGRESSION {line}")
+        print(f"{len(flagged)} regressions against {args.compare}")
+        return 1 if flagged else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+
+# columnar plant table: the shared x vector plus a (plants x time points)
+# float array, one contiguous row per plant. behaves like the old
+# {"x": ..., plant: ...} dict, so data["x"], data[plant] and data.keys() work
+class Dataset:
+    def __init__(self, x, names, values):
+        self.x = np.asarray(x)
+        self.names = [str(name) for name in names]
+        self.values = np.asarray(values)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_frame(cls, df, dtype=np.float64):
+        names = [name for name in df.columns if name != "x"]
+        values = np.ascontiguousarray(df[names].to_numpy(dtype=dtype).T)
+        return cls(df["x"].to_numpy(dtype=np.float64), names, values)
+
+    def keys(self):
+        return ["x"] + self.names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.names) + 1
+
+    def __contains__(self, key):
+        return key == "x" or str(key) in self._index
+
+    def __getitem__(self, key):
+        if key == "x":
+            return self.x
+        return self.values[self._index[str(key)]]
+
+    # True if this dataset has every plant column of previous and its x is
+    # previous.x with at least one time point appended
+    def extends(self, previous):
+        n = len(previous.x)
+        return (
+                len(self.x) > n and set(previous.names) <= set(self.names)
+                and np.array_equal(self.x[:n], previous.x, equal_nan=True)
+                )
+
+
+# dataset keys are uuid4().hex; anything else coming back from the browser
+# (e.g. "..") never reaches the file system
+def valid_key(key):
+    return isinstance(key, str) and re.fullmatch("[0-9a-f]{32}", key) is not None
+
+
+# server-side registry of uploaded datasets. each dataset is saved as .npy
+# files under directory/<key>/ and read back memory-mapped, so only the key
+# has to travel through dcc.Store. datasets unused for ttl seconds are
+# evicted; the directory can be shared between processes
+class DatasetStore:
+    def __init__(self, directory=None, ttl=7200):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "gcurve-datasets")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.ttl = ttl
+        self._datasets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def put(self, dataset):
+        key = uuid.uuid4().hex
+        path = os.path.join(self.directory, key)
+        tmp_path = path + ".tmp"
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "x.npy"), dataset.x)
+        np.save(os.path.join(tmp_path, "values.npy"), dataset.values)
+        with open(os.path.join(tmp_path, "names.json"), "w") as f:
+            json.dump(dataset.names, f)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._datasets[key] = self._load(path)
+        self._sweep()
+        return key
+
+    def get(self, key):
+        if not valid_key(key):
+            return None
+        path = os.path.join(self.directory, key)
+        self._sweep()
+        with self._lock:
+            if not os.path.isdir(path):
+                self._datasets.pop(key, None)
+                return None
+            if key not in self._datasets:
+                self._datasets[key] = self._load(path)
+            os.utime(path)
+            return self._datasets[key]
+
+    # the most recently used stored dataset that dataset extends, or None
+    def find_extended(self, dataset):
+        entries = [entry for entry in os.scandir(self.directory) if entry.is_dir() and valid_key(entry.name)]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime, reverse=True):
+            try:
+                previous = self._load(entry.path)
+            except (OSError, ValueError):
+                continue
+            if dataset.extends(previous):
+                return self.get(entry.name)
+        return None
+
+    def remove(self, key):
+        if not valid_key(key):
+            return
+        with self._lock:
+            self._datasets.pop(key, None)
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def _load(self, path):
+        with open(os.path.join(path, "names.json")) as f:
+            names = json.load(f)
+        x = np.load(os.path.join(path, "x.npy"), mmap_mode="r")
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+        return Dataset(x, names, values)
+
+    # drop datasets whose directory was not touched for ttl seconds
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < min(self.ttl, 60):
+            return
+        self._last_sweep = now
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and now - entry.stat().st_mtime > self.ttl:
+                self.remove(entry.name)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from dataset_store import DatasetStore
+from exports import build_export, export_formats, write_export
+from utility_funcs import GridSpec, default_grid
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# a running job's worker refreshes its updated time every heartbeat_interval
+# seconds; a running job not refreshed for stale_after seconds lost its worker
+# (killed, crashed, or its app process restarted) and is failed
+heartbeat_interval = 5.0
+stale_after = 60.0
+
+
+# sqlite-backed queue of whole-dataset export jobs. the database file is the
+# only shared state, so the app and the worker processes each open their own
+# connection to it (one per thread and process, forked app workers included). status goes
+# queued -> running -> done / failed / cancelled; running jobs record the
+# pid of their worker
+class JobQueue:
+    def __init__(self, path, stale_after=stale_after):
+        self.path = path
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, dataset_key TEXT, kind TEXT, threshold REAL, grid TEXT, "
+                "status TEXT, done INTEGER, total INTEGER, result_path TEXT, error TEXT, "
+                "created REAL, updated REAL)"
+                )
+        # queues created before exports had a file format hold csv jobs only
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "format" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN format TEXT DEFAULT 'csv'")
+        if "worker" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN worker INTEGER")
+
+    @property
+    def _db(self):
+        if getattr(self._local, "db", None) is None or self._local.pid != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def submit(self, dataset_key, kind, threshold=0.005, grid=None, fmt="csv"):
+        grid = default_grid if grid is None else grid
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, 'queued', 0, 0, NULL, NULL, ?, ?, ?, NULL)",
+                (job_id, dataset_key, kind, float(threshold), json.dumps(list(grid)), now, now, fmt),
+                )
+        return job_id
+
+    # take the oldest queued job for this process, or None if there is
+    # nothing to do. jobs whose worker went away are failed first
+    def claim(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self.fail_stale()
+            row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                    ).fetchone()
+            if row is not None:
+                self._db.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, updated = ? WHERE id = ?",
+                        (os.getpid(), time.time(), row[0]),
+                        )
+        finally:
+            self._db.execute("COMMIT")
+        return None if row is None else self.status(row[0])
+
+    def heartbeat(self, job_id):
+        self._db.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id),
+                )
+
+    def fail_stale(self):
+        self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                "WHERE status = 'running' AND updated < ?",
+                ("the export worker stopped, please try again", time.time(), time.time() - self.stale_after),
+                )
+
+    # fail the running jobs of the given worker pids (workers being stopped)
+    def fail_workers(self, pids, error):
+        for pid in pids:
+            self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                    "WHERE status = 'running' AND worker = ?",
+                    (error, time.time(), pid),
+                    )
+
+    def status(self, job_id):
+        cursor = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job["grid"] = GridSpec(*json.loads(job["grid"]))
+        return job
+
+    # record progress; raises JobCancelled once the job was cancelled
+    def progress(self, job_id, done, total):
+        self._db.execute(
+                "UPDATE jobs SET done = ?, total = ?, updated = ? WHERE id = ?",
+                (done, total, time.time(), job_id),
+                )
+        if self.status(job_id)["status"] == "cancelled":
+            raise JobCancelled(job_id)
+
+    def finish(self, job_id, result_path):
+        self._db.execute(
+                "UPDATE jobs SET status = 'done', result_path = ?, updated = ? "
+                "WHERE id = ? AND status = 'running'",
+                (result_path, time.time(), job_id),
+                )
+
+    def fail(self, job_id, error):
+        self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                "WHERE id = ? AND status = 'running'",
+                (error, time.time(), job_id),
+                )
+
+    def cancel(self, job_id):
+        self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+                )
+
+    # a finished job for the same export, so repeated clicks reuse its result
+    def find_done(self, dataset_key, kind, threshold=0.005, grid=None, fmt="csv"):
+        grid = default_grid if grid is None else grid
+        row = self._db.execute(
+                "SELECT id, result_path FROM jobs WHERE status = 'done' AND dataset_key = ? "
+                "AND kind = ? AND threshold = ? AND grid = ? AND format = ? ORDER BY updated DESC LIMIT 1",
+                (dataset_key, kind, float(threshold), json.dumps(list(grid)), fmt),
+                ).fetchone()
+        if row is not None and os.path.exists(row[1]):
+            return row[0]
+
+
+# body of a worker process: run queued jobs one after the other. the job
+# body is the save_* function of the requested export, written in the job's format
+def worker_loop(queue_path, dataset_dir, results_dir, poll_interval=0.5):
+    queue = JobQueue(queue_path)
+    datasets = DatasetStore(dataset_dir)
+    while True:
+        job = queue.claim()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        job_id = job["id"]
+        stopped = threading.Event()
+        threading.Thread(target=_heartbeat, args=(queue, job_id, stopped), daemon=True).start()
+        try:
+            data = datasets.get(job["dataset_key"])
+            if data is None:
+                raise LookupError("dataset expired, please upload it again")
+            df = build_export(
+                    data, job["kind"], job["threshold"], job["grid"],
+                    progress=lambda done, total: queue.progress(job_id, done, total),
+                    )
+            result_path = os.path.join(results_dir, job_id + export_formats[job["format"]])
+            write_export(df, job["kind"], result_path + ".tmp", job["format"])
+            os.replace(result_path + ".tmp", result_path)
+            queue.finish(job_id, result_path)
+        except JobCancelled:
+            pass
+        except Exception as e:
+            queue.fail(job_id, f"{type(e).__name__}: {e}")
+        finally:
+            stopped.set()
+
+
+def _heartbeat(queue, job_id, stopped):
+    while not stopped.wait(heartbeat_interval):
+        queue.heartbeat(job_id)
+
+
+# queue plus a pool of worker processes, started on the first submit.
+# workers are spawned (not forked) so each opens its own sqlite connections
+class JobRunner:
+    def __init__(self, directory=None, dataset_dir=None, workers=1):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "gcurve-jobs")
+        self.results_dir = os.path.join(directory, "results")
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.queue_path = os.path.join(directory, "jobs.sqlite")
+        self.queue = JobQueue(self.queue_path)
+        self.dataset_dir = dataset_dir
+        self.workers = workers
+        self._processes = []
+        atexit.register(self.stop)
+
+    def submit(self, dataset_key, kind, threshold=0.005, grid=None, fmt="csv"):
+        job_id = self.queue.find_done(dataset_key, kind, threshold, grid, fmt)
+        if job_id is not None:
+            return job_id
+        self._start_workers()
+        return self.queue.submit(dataset_key, kind, threshold, grid, fmt)
+
+    # a running job that stopped beating is reported failed, also when no
+    # worker is left to notice it in claim
+    def status(self, job_id):
+        job = self.queue.status(job_id)
+        if job is not None and job["status"] == "running" and job["updated"] < time.time() - self.queue.stale_after:
+            self.queue.fail_stale()
+            job = self.queue.status(job_id)
+        return job
+
+    def cancel(self, job_id):
+        self.queue.cancel(job_id)
+
+    def _start_workers(self):
+        self._processes = [process for process in self._processes if process.is_alive()]
+        context = multiprocessing.get_context("spawn")
+        while len(self._processes) < self.workers:
+            process = context.Process(
+                    target=worker_loop,
+                    args=(self.queue_path, self.dataset_dir, self.results_dir),
+                    )
+            process.start()
+            self._processes.append(process)
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self.queue.fail_workers([process.pid for process in self._processes], "the app stopped, please try again")
+        self._processes = []
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import io
+import os
+
+from utility_funcs import (
+        default_grid, save_bootstrap_values, save_infer_values, save_parameters_values, save_t_values,
+        )
+
+
+export_kinds = ["Inferred_Values", "T_Values", "Parameters_Values", "Bootstrap_Intervals"]
+
+# file formats and their suffixes. parquet and arrow (arrow ipc, i.e.
+# feather v2) are columnar and compressed with GCURVE_COLUMNAR_COMPRESSION
+# (zstd, lz4, ... or "uncompressed" for zero-copy memory-mapped arrow reads);
+# they need pyarrow and are only offered when it is installed
+export_formats = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+columnar_compression = os.environ.get("GCURVE_COLUMNAR_COMPRESSION", "zstd")
+
+
+def available_formats():
+    if importlib.util.find_spec("pyarrow") is None:
+        return ["csv"]
+    return list(export_formats)
+
+
+# build one export for an uploaded dataset. fits come from the shared fit
+# cache, so plants already viewed or exported are not refitted. progress is
+# passed on to the save_* function, see fit_plants
+def build_export(data, kind, threshold=0.005, grid=None, progress=None):
+    grid = default_grid if grid is None else grid
+    if kind == "T_Values":
+        return save_t_values(data, threshold, grid=grid, progress=progress)
+    elif kind == "Parameters_Values":
+        return save_parameters_values(data, progress=progress)
+    elif kind == "Inferred_Values":
+        return save_infer_values(data, grid=grid, progress=progress)
+    elif kind == "Bootstrap_Intervals":
+        return save_bootstrap_values(data, threshold, grid=grid, progress=progress)
+    raise ValueError(f"unknown export: {kind}")
+
+
+# csv text of an export, written straight from memory
+def export_csv(df):
+    buffer = io.StringIO()
+    df.to_csv(buffer)
+    return buffer.getvalue()
+
+
+# an export as a columnar table with a key column first: parameters, t values
+# and bootstrap intervals get one row per plant (their csv rows become the
+# columns, so e.g. t3_day alone can be read), inferred curves on a uniform
+# grid keep one column per plant after the day column, and the long
+# (plant, day, value) table of adaptive grids stays as it is
+def columnar_frame(df, kind):
+    if kind != "Inferred_Values":
+        df = df.T.infer_objects()
+        df.index.name = "plant"
+    if df.index.name is not None:
+        df = df.reset_index()
+    df.columns = [str(column) for column in df.columns]
+    return df
+
+
+# write an export to path as csv, parquet or arrow (from the suffix if fmt is None)
+def write_export(df, kind, path, fmt=None, compression=None):
+    fmt = _path_format(path) if fmt is None else fmt
+    if fmt == "csv":
+        with open(path, "w") as f:
+            f.write(export_csv(df))
+        return
+
+    # pyarrow is only needed for the columnar formats
+    import pyarrow as pa
+
+    compression = columnar_compression if compression is None else compression
+    table = pa.Table.from_pandas(columnar_frame(df, kind), preserve_index=False)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, path, compression=compression)
+    elif fmt == "arrow":
+        import pyarrow.feather as feather
+
+        feather.write_feather(table, path, compression=compression)
+    else:
+        raise ValueError(f"unknown export format: {fmt}")
+
+
+# read a parquet / arrow export memory-mapped, decoding only the given
+# columns (plus the key column, which becomes the index); all if None.
+#   read_export("results/plate/t_values.parquet", ["t3_day", "t3_value"])
+def read_export(path, columns=None):
+    import pyarrow as pa
+
+    fmt = _path_format(path)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(path, memory_map=True)
+    elif fmt == "arrow":
+        import pyarrow.feather as feather
+
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    else:
+        raise ValueError(f"not a columnar export: {path}")
+
+    key = schema.names[0]
+    if columns is not None:
+        columns = [key] + [column for column in columns if column != key]
+    if fmt == "parquet":
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas().set_index(key)
+
+
+def _path_format(path):
+    for fmt, suffix in export_formats.items():
+        if str(path).endswith(suffix):
+            return fmt
+    raise ValueError(f"unknown export format: {path}")
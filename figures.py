@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import functools
+
+import numpy as np
+
+from utility_funcs import T_MISSING, default_y_range, t_names
+
+
+# t marker slots of the figure skeleton as (t name, panel); panel 1 is the
+# growth function, 2 the first and 3 the second derivative
+marker_slots = (
+        [(name, 1) for name in t_names]
+        + [("t3", 2)]
+        + [("t1", 3), ("t5", 3)]
+        )
+panel_cells = {1: dict(row=1, col=1), 2: dict(row=2, col=1), 3: dict(row=2, col=2)}
+
+
+# subplot skeleton with every trace and annotation in place but no data.
+# built once per y range; plants only fill in the data arrays and t markers
+@functools.lru_cache(maxsize=8)
+def figure_template(y_range=default_y_range):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(
+            rows=2, cols=2,
+            specs=[[{"colspan": 2}, None], [{}, {}]],
+            subplot_titles=("Growth Function", "Frist Derivative", "Second Derivative"),
+            row_heights=[0.6, 0.4] ,
+            )
+
+    def add_markers(panel):
+        for name, slot_panel in marker_slots:
+            if slot_panel == panel:
+                fig.add_trace(
+                        go.Scatter(x=[], y=[], mode="lines", line=dict(color="orange", dash="dash")),
+                        **panel_cells[panel],
+                        )
+
+    # actual data
+    fig.add_trace(
+            go.Scatter(x=[], y=[], mode="markers", marker=dict(size=8, color="red", opacity=0.5)),
+            row=1, col=1,
+            )
+    # infer data, first and second derivative, each followed by its t lines
+    for panel in (1, 2, 3):
+        fig.add_trace(go.Scatter(x=[], y=[], mode="lines", line=dict(color="steelblue")), **panel_cells[panel])
+        add_markers(panel)
+
+    for name, panel in marker_slots:
+        fig.add_annotation(
+                x=0, y=0,
+                text=name,
+                font=dict(size=20),
+                showarrow=True,
+                arrowhead=2 if (name, panel) == ("t1", 1) else 1,
+                visible=False,
+                **panel_cells[panel],
+                )
+    fig.update_yaxes(range=list(y_range) if y_range is not None else None, row=1, col=1)
+    fig.update_layout(showlegend=False)
+    return fig.to_dict()
+
+
+# positions of the data traces and marker slots in the skeleton
+def _slot_indices():
+    traces = {"data": 0, 1: 1}
+    index = 2
+    for panel in (1, 2, 3):
+        if panel != 1:
+            traces[panel] = index
+            index += 1
+        for slot in marker_slots:
+            if slot[1] == panel:
+                traces[slot] = index
+                index += 1
+    return traces
+
+
+trace_index = _slot_indices()
+
+
+# curve values as sent to the browser: 6 significant digits are well below
+# a pixel and keep the json several times shorter than full float64 reprs
+def _rounded(curve):
+    return [float(f"{value:.6g}") for value in np.asarray(curve, dtype=float)]
+
+
+# which marker slots the t values show, in marker_slots order
+def marker_visibility(t_values):
+    return [t_values[name][0] != T_MISSING for name, _ in marker_slots]
+
+
+# per-plant content of the skeleton: {trace index: properties} and
+# {marker slot number: annotation properties}. t days need not be grid points,
+# marker heights are interpolated. with_x=False leaves out the curve x arrays.
+# shown (marker_visibility of the figure being updated) leaves out the
+# visible flags that stay the same; None sends all of them
+def figure_updates(x_value, y_value, interval, values, values_1st, values_2nd, t_values, with_x=True,
+                   shown=None):
+    interval = np.asarray(interval, dtype=float)
+    curves = {1: np.asarray(values), 2: np.asarray(values_1st), 3: np.asarray(values_2nd)}
+
+    traces = {trace_index["data"]: {"x": np.asarray(x_value).tolist(), "y": np.asarray(y_value).tolist()}}
+    for panel, curve in curves.items():
+        traces[trace_index[panel]] = {"y": _rounded(curve)}
+        if with_x:
+            traces[trace_index[panel]]["x"] = _rounded(interval)
+
+    annotations = {}
+    for slot_number, (visible, (name, panel)) in enumerate(zip(marker_visibility(t_values), marker_slots)):
+        trace = traces.setdefault(trace_index[(name, panel)], {})
+        annotation = annotations.setdefault(slot_number, {})
+        if shown is None or shown[slot_number] != visible:
+            trace["visible"] = annotation["visible"] = visible
+        if visible:
+            day = float(f"{t_values[name][0]:.6g}")
+            height = float(f"{np.interp(day, interval, curves[panel]):.6g}")
+            trace.update(x=[day, day], y=[0, height])
+            annotation.update(x=day, y=height)
+    return (
+            {index: properties for index, properties in traces.items() if properties},
+            {number: properties for number, properties in annotations.items() if properties},
+            )
+
+
+# complete figure (plain dict) for a plant: a copy of the skeleton with the updates applied
+def full_figure(x_value, y_value, interval, values, values_1st, values_2nd, t_values,
+                y_range=default_y_range):
+    fig = copy.deepcopy(figure_template(y_range))
+    traces, annotations = figure_updates(x_value, y_value, interval, values, values_1st, values_2nd, t_values)
+    for index, properties in traces.items():
+        fig["data"][index].update(properties)
+    offset = len(fig["layout"]["annotations"]) - len(marker_slots)
+    for slot_number, properties in annotations.items():
+        fig["layout"]["annotations"][offset + slot_number].update(properties)
+    return fig
+
+
+# partial update of a figure already showing the skeleton: only the data
+# arrays and t marker positions (and visibility changes, given shown) are
+# sent to the browser, one merge per trace / annotation
+def figure_patch(x_value, y_value, interval, values, values_1st, values_2nd, t_values,
+                 y_range=default_y_range, with_x=False, shown=None):
+    from dash import Patch
+
+    patch = Patch()
+    traces, annotations = figure_updates(
+            x_value, y_value, interval, values, values_1st, values_2nd, t_values, with_x=with_x, shown=shown,
+            )
+    for index, properties in traces.items():
+        patch["data"][index].update(properties)
+    offset = len(figure_template(y_range)["layout"]["annotations"]) - len(marker_slots)
+    for slot_number, properties in annotations.items():
+        patch["layout"]["annotations"][offset + slot_number].update(properties)
+    return patch
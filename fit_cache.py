@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# content key of a fit: hash of the (x, y) arrays, the model and the fitter settings
+def fit_key(x, y, model, **settings):
+    h = hashlib.blake2b(digest_size=16)
+    for arr in (x, y):
+        arr = np.ascontiguousarray(arr, dtype=float)
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+    h.update(model.encode())
+    h.update(repr(sorted(settings.items())).encode())
+    return h.hexdigest()
+
+
+# bounded LRU cache of fit results, optionally persisted to a sqlite file
+# so results survive restarts. the disk table is trimmed back to disk_maxsize
+# entries, least recently used first, once it grows disk_margin entries past
+# that (so not on every write). several processes (e.g. the workers of
+# serve.py) can share the file: each opens its own connection in WAL mode,
+# and a disk read or write that stays locked counts as a miss / is dropped
+class FitCache:
+    def __init__(self, maxsize=1024, path=None, disk_maxsize=100000, disk_margin=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self.disk_margin = max(disk_maxsize // 10, 1) if disk_margin is None else disk_margin
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        # rows on disk as far as this process knows: counted at start and
+        # after every trim, plus this process's own writes since
+        self._disk_rows = 0
+        if path is not None:
+            self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS fits "
+                    "(key TEXT PRIMARY KEY, value BLOB, atime REAL)"
+                    )
+            self._db.execute("CREATE INDEX IF NOT EXISTS fits_atime ON fits (atime)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM fits").fetchone()[0]
+
+    # connection of this process; a forked child opens its own instead of
+    # using the parent's
+    @property
+    def _db(self):
+        if self.path is None:
+            return None
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data or self._disk_has(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            value = self._disk_get(key)
+            if value is not None:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    # several (key, value) pairs in one disk transaction
+    def put_many(self, items):
+        items = list(items)
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            self._disk_put(items)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM fits")
+                self._db.commit()
+                self._disk_rows = 0
+
+    def _remember(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    # membership only, without touching the access time
+    def _disk_has(self, key):
+        db = self._db
+        if db is None:
+            return False
+        try:
+            return db.execute("SELECT 1 FROM fits WHERE key = ?", (key,)).fetchone() is not None
+        except sqlite3.OperationalError:
+            return False
+
+    def _disk_get(self, key):
+        db = self._db
+        if db is None:
+            return None
+        row = None
+        try:
+            row = db.execute("SELECT value FROM fits WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE fits SET atime = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+        except sqlite3.OperationalError:
+            db.rollback()
+            if row is None:
+                return None
+        return pickle.loads(row[0])
+
+    def _disk_put(self, items):
+        db = self._db
+        if db is None or not items:
+            return
+        now = time.time()
+        try:
+            db.executemany(
+                    "INSERT OR REPLACE INTO fits (key, value, atime) VALUES (?, ?, ?)",
+                    [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now) for key, value in items],
+                    )
+            db.commit()
+        except sqlite3.OperationalError:
+            db.rollback()
+            return
+        self._disk_rows += len(items)
+        if self._disk_rows > self.disk_maxsize + self.disk_margin:
+            self._disk_trim()
+
+    # drop the least recently used rows beyond disk_maxsize; the other
+    # processes sharing the file wrote rows too, so recount first
+    def _disk_trim(self):
+        db = self._db
+        try:
+            self._disk_rows = db.execute("SELECT COUNT(*) FROM fits").fetchone()[0]
+            if self._disk_rows > self.disk_maxsize:
+                db.execute(
+                        "DELETE FROM fits WHERE key IN (SELECT key FROM fits ORDER BY atime LIMIT ?)",
+                        (self._disk_rows - self.disk_maxsize,),
+                        )
+                db.commit()
+                self._disk_rows = self.disk_maxsize
+        except sqlite3.OperationalError:
+            db.rollback()
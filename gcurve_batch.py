@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# headless batch mode: fit every plant of many input files and write
+# parameters, t values and inferred curves without starting the Dash app.
+#
+#   python gcurve_batch.py data/ more.xlsx -o results/ --workers 8
+#
+# each input gets results/<name>/ (results/<name>-<path hash>/ when several
+# inputs share the file name) with parameters.csv, t_values.csv,
+# inferred_values.csv, bootstrap_intervals.csv (with --bootstrap) and
+# done.json; inputs whose done.json matches the current file and settings
+# are skipped, so an interrupted run resumes. --format parquet / arrow writes
+# columnar files instead of csv, read them with exports.read_export
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import utility_funcs
+from exports import export_formats, write_export
+from growth_models import models
+from ingest import read_table
+from utility_funcs import (
+        GridSpec, save_bootstrap_values, save_infer_values, save_parameters_values, save_t_values,
+        )
+
+
+input_suffixes = (".csv", ".xls", ".xlsx")
+# file name -> (export kind, builder)
+outputs = {
+        "parameters": ("Parameters_Values", lambda data, args: save_parameters_values(data)),
+        "t_values": ("T_Values", lambda data, args: save_t_values(
+            data, args.threshold, method=args.t_method, grid=grid_from_args(args),
+            )),
+        "inferred_values": ("Inferred_Values", lambda data, args: save_infer_values(data, grid=grid_from_args(args))),
+        "bootstrap_intervals": ("Bootstrap_Intervals", lambda data, args: save_bootstrap_values(
+            data, args.threshold, grid=grid_from_args(args),
+            n_resamples=args.bootstrap, kind=args.bootstrap_kind, seed=args.seed,
+            )),
+        }
+
+
+def grid_from_args(args):
+    return GridSpec(start=args.grid_start, stop=args.grid_stop, num=args.grid_points, adaptive=args.adaptive)
+
+
+# input files from a mix of files and directories, in a stable order
+def collect_inputs(paths):
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(input_suffixes) and not name.startswith("~$")
+                ))
+        else:
+            inputs.append(path)
+    # the same file given twice (by itself and through its directory) runs once
+    unique = {}
+    for path in inputs:
+        unique.setdefault(os.path.abspath(path), path)
+    return list(unique.values())
+
+
+# results directory of every input: its file name without the suffix, plus a
+# short hash of its path when another input has the same name (d1/plate.xlsx
+# and d2/plate.csv), so no two inputs write to the same directory
+def output_dirs(inputs, output):
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in inputs]
+    counts = {}
+    for stem in stems:
+        counts[stem.lower()] = counts.get(stem.lower(), 0) + 1
+    dirs = {}
+    for path, stem in zip(inputs, stems):
+        if counts[stem.lower()] > 1:
+            stem += "-" + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+        dirs[path] = os.path.join(output, stem)
+    return dirs
+
+
+def read_dataset(path):
+    data, report = read_table(path, os.path.basename(path))
+    print(f"read    {report.summary()}")
+    return data
+
+
+# identifies an input file and the settings its results were produced with
+def run_signature(path, args):
+    stat = os.stat(path)
+    settings = {
+            "size": stat.st_size, "mtime": stat.st_mtime,
+            "threshold": args.threshold, "t_method": args.t_method, "fit_mode": args.fit_mode,
+            "model": args.model, "criterion": args.criterion, "solver": args.solver, "format": args.format,
+            "bootstrap": args.bootstrap, "bootstrap_kind": args.bootstrap_kind, "seed": args.seed,
+            "grid": list(grid_from_args(args)),
+            }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def already_done(out_dir, signature):
+    try:
+        with open(os.path.join(out_dir, "done.json")) as f:
+            return json.load(f).get("signature") == signature
+    except (OSError, ValueError):
+        return False
+
+
+def process_file(path, out_dir, args):
+    signature = run_signature(path, args)
+    if not args.force and already_done(out_dir, signature):
+        print(f"skip    {path} (already processed)")
+        return "skipped"
+
+    start = time.perf_counter()
+    data = read_dataset(path)
+    os.makedirs(out_dir, exist_ok=True)
+    # the first export fits every plant, the others reuse the cached fits
+    for name, (kind, build) in outputs.items():
+        if name == "bootstrap_intervals" and not args.bootstrap:
+            continue
+        write_export(build(data, args), kind, os.path.join(out_dir, name + export_formats[args.format]), args.format)
+
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(out_dir, "done.json"), "w") as f:
+        json.dump({"input": os.path.abspath(path), "signature": signature,
+                   "plants": len(data) - 1, "seconds": elapsed}, f, indent=2)
+    print(f"done    {path}: {len(data) - 1} plants in {elapsed:.1f}s")
+    return "done"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fit growth curves for many files without the Dash app.")
+    parser.add_argument("inputs", nargs="+", help="csv / xlsx files or directories containing them")
+    parser.add_argument("-o", "--output", required=True, help="results directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="fitting worker processes")
+    parser.add_argument("--executor", choices=["process", "thread", "serial"], default="process")
+    parser.add_argument("--threshold", type=float, default=0.005)
+    parser.add_argument("--fit-mode", choices=["default", "guided"], default="default")
+    parser.add_argument("--model", choices=list(models) + ["best"], default="5pl",
+                        help="growth model, or best to select one per plant")
+    parser.add_argument("--criterion", choices=["aic", "bic"], default="aic", help="model selection criterion")
+    parser.add_argument("--solver", choices=["pool", "batched"], default="pool",
+                        help="batched fits all plants in one vectorized optimization first")
+    parser.add_argument("--t-method", choices=["grid", "root"], default="grid")
+    parser.add_argument("--format", choices=list(export_formats), default="csv",
+                        help="parquet / arrow: compressed columnar files (needs pyarrow)")
+    parser.add_argument("--grid-start", type=float, default=0.0)
+    parser.add_argument("--grid-stop", type=float, default=129.0)
+    parser.add_argument("--grid-points", type=int, default=130)
+    parser.add_argument("--adaptive", action="store_true", help="adaptive grid sampling")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="also write bootstrap confidence intervals from N resamples per plant")
+    parser.add_argument("--bootstrap-kind", choices=["residual", "case"], default="residual")
+    parser.add_argument("--seed", type=int, default=0, help="bootstrap seed")
+    parser.add_argument("--force", action="store_true", help="reprocess files that are already done")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    utility_funcs.batch_workers = args.workers
+    utility_funcs.batch_executor = args.executor
+    utility_funcs.default_fit_mode = args.fit_mode
+    utility_funcs.default_model = args.model
+    utility_funcs.default_criterion = args.criterion
+    utility_funcs.default_solver = args.solver
+
+    inputs = collect_inputs(args.inputs)
+    out_dirs = output_dirs(inputs, args.output)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    for path in inputs:
+        try:
+            counts[process_file(path, out_dirs[path], args)] += 1
+        except Exception as e:
+            print(f"failed  {path}: {type(e).__name__}: {e}", file=sys.stderr)
+            counts["failed"] += 1
+
+    print(f"{len(inputs)} files: {counts['done']} done, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
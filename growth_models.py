@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+
+# 5 parameters logsitic 
+def five_log_func(x, a, b, c, d, g):
+    return d + (a - d)/(1 + (x/c)**b)**g
+
+
+# analytic jacobian of the 5 parameters logistic, columns in a, b, c, d, g order.
+# like every jacobian here it is (points x params) for scalar parameters and
+# (plants x points x params) for parameter columns of shape (plants, 1).
+# with u = (x/c)**b and f = d + (a - d) * (1 + u)**-g:
+#   df/da = (1 + u)**-g                df/dd = 1 - (1 + u)**-g
+#   df/db = df/du * u * log(x/c)       df/dc = -df/du * u * b/c
+#   df/dg = -(a - d) * (1 + u)**-g * log(1 + u)
+def five_log_jac(x, a, b, c, d, g):
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        r = x / c
+        u = r**b
+        base_g = (1 + u)**-g
+        df_du = -(a - d) * g * base_g / (1 + u)
+        log_r = np.where(u > 0, np.log(r), 0.0)
+
+        columns = (
+                base_g, df_du * u * log_r, -df_du * u * b / c, 1 - base_g,
+                -(a - d) * base_g * np.log1p(u),
+                )
+    return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+
+# data-driven starting values and bounds for the 5 parameters logistic.
+# a and d start at the min / max of y, b and c come from a linear fit of
+# the logit log((y - a) / (d - y)) = b * log(x) - b * log(c) (the g = 1 case)
+def five_log_guess(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    y_min, y_max = np.min(y), np.max(y)
+    span = max(y_max - y_min, 1e-6)
+    x_max = max(np.max(x), 1e-6)
+
+    lo, hi = y_min - 0.01 * span, y_max + 0.01 * span
+    inside = (x > 0) & (y > y_min + 0.05 * span) & (y < y_max - 0.05 * span)
+    if np.count_nonzero(inside) >= 2:
+        slope, intercept = np.polyfit(np.log(x[inside]), np.log((y[inside] - lo)/(hi - y[inside])), 1)
+        b = slope
+        c = np.exp(-intercept / slope) if slope != 0 else np.median(x)
+    else:
+        b = 1.0
+        c = np.median(x)
+
+    lower = [y_min - span, 1e-3, 1e-6, y_min, 1e-3]
+    upper = [y_max, 100.0, 10 * x_max, y_max + span, 1e4]
+    p0 = np.clip([y_min, b, c, y_max, 1.0], lower, upper)
+    return p0, (lower, upper)
+
+
+# evaluate curve, first and second derivative over a whole grid in one pass
+# with u = (x/c)**b:
+#   f   = d + (a - d) * (1 + u)**-g
+#   f'  = -(a - d) * g * b/c * (x/c)**(b-1) * (1 + u)**(-g-1)
+#   f'' = -(a - d) * g * b/c**2 * (1 + u)**(-g-2)
+#         * ((b - 1) * (x/c)**(b-2) * (1 + u) - (g + 1) * b * (x/c)**(2b-2))
+# results agree with the former sympy subs/float path to within
+# 1e-12 relative to the largest magnitude on the grid (floating point
+# reassociation only)
+def evaluate_five_log(interval, a, b, c, d, g):
+    x = np.asarray(interval, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        r = x / c
+        u = r**b
+        base = 1 + u
+        base_g = base**-g
+        r_b1 = r**(b - 1)
+
+        values = d + (a - d) * base_g
+        values_1st = -(a - d) * g * b / c * r_b1 * base_g / base
+        values_2nd = (
+                -(a - d) * g * b / c**2 * base_g / base**2
+                * ((b - 1) * r**(b - 2) * base - (g + 1) * b * r_b1**2)
+                )
+    return values, values_1st, values_2nd
+
+
+# 4 parameters logistic, the 5 parameters one with g = 1
+def four_log_func(x, a, b, c, d):
+    return d + (a - d)/(1 + (x/c)**b)
+
+
+def four_log_jac(x, a, b, c, d):
+    return five_log_jac(x, a, b, c, d, 1.0)[..., :4]
+
+
+def four_log_guess(x, y):
+    p0, (lower, upper) = five_log_guess(x, y)
+    return p0[:4], (lower[:4], upper[:4])
+
+
+def evaluate_four_log(interval, a, b, c, d):
+    return evaluate_five_log(interval, a, b, c, d, 1.0)
+
+
+# gompertz with lower asymptote a, upper asymptote d, rate b and inflection
+# day c. with z = -b * (x - c) and e = exp(z):
+#   f   = a + (d - a) * exp(-e)
+#   f'  = (d - a) * b * e * exp(-e)
+#   f'' = (d - a) * b**2 * (e**2 - e) * exp(-e)
+# e * exp(-e) is taken as exp(z - e) so a large e gives 0, not inf * 0
+def gompertz_func(x, a, b, c, d):
+    with np.errstate(over="ignore"):
+        return a + (d - a) * np.exp(-np.exp(-b * (np.asarray(x, dtype=float) - c)))
+
+
+def gompertz_jac(x, a, b, c, d):
+    x = np.asarray(x, dtype=float)
+    with np.errstate(over="ignore", invalid="ignore"):
+        z = -b * (x - c)
+        e = np.exp(z)
+        decay = np.exp(-e)
+        e_decay = np.exp(z - e)
+
+        columns = (1 - decay, (d - a) * e_decay * (x - c), -(d - a) * e_decay * b, decay)
+    return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+
+# a and d from the range of y, b and c from a linear fit of
+# -log(-log((y - a) / (d - a))) = b * x - b * c
+def gompertz_guess(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lo, hi, span, inside = _asymptote_guess(y)
+    b, c = _linear_guess(x[inside], -np.log(-np.log((y[inside] - lo)/(hi - lo))), x)
+    return _sigmoid_start(x, y, span, [lo, b, c, hi])
+
+
+def evaluate_gompertz(interval, a, b, c, d):
+    x = np.asarray(interval, dtype=float)
+    with np.errstate(over="ignore", invalid="ignore"):
+        z = -b * (x - c)
+        e = np.exp(z)
+        e_decay = np.exp(z - e)
+
+        values = a + (d - a) * np.exp(-e)
+        values_1st = (d - a) * b * e_decay
+        values_2nd = (d - a) * b**2 * (np.exp(2 * z - e) - e_decay)
+    return values, values_1st, values_2nd
+
+
+# richards with lower asymptote a, upper asymptote d, rate b, location c and
+# shape g > 0. with z = -b * (x - c), e = exp(z) and s = 1 + g * e:
+#   f   = a + (d - a) * s**(-1/g)
+#   f'  = (d - a) * b * e * s**(-1/g - 1)
+#   f'' = (d - a) * b**2 * (e**2 - e) * s**(-1/g - 2)
+# log(s) is taken as logaddexp(0, z + log(g)) so a large e does not overflow
+def richards_func(x, a, b, c, d, g):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = -b * (np.asarray(x, dtype=float) - c)
+        return a + (d - a) * np.exp(-np.logaddexp(0, z + np.log(g)) / g)
+
+
+def richards_jac(x, a, b, c, d, g):
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        z = -b * (x - c)
+        log_s = np.logaddexp(0, z + np.log(g))
+        power = np.exp(-log_s / g)
+        e_power = np.exp(z - (1/g + 1) * log_s)
+
+        columns = (
+                1 - power, (d - a) * e_power * (x - c), -(d - a) * e_power * b, power,
+                (d - a) * power * (log_s / g**2 - np.exp(z - log_s) / g),
+                )
+    return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+
+# a and d from the range of y, b and c from a linear fit of the logistic
+# (g = 1) log((y - a) / (d - y)) = b * x - b * c. g stays above 1e-2, below that
+# the curve is the gompertz for all practical purposes
+def richards_guess(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lo, hi, span, inside = _asymptote_guess(y)
+    b, c = _linear_guess(x[inside], np.log((y[inside] - lo)/(hi - y[inside])), x)
+    p0, (lower, upper) = _sigmoid_start(x, y, span, [lo, b, c, hi])
+    return np.append(p0, 1.0), (lower + [1e-2], upper + [1e2])
+
+
+def evaluate_richards(interval, a, b, c, d, g):
+    x = np.asarray(interval, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        z = -b * (x - c)
+        log_s = np.logaddexp(0, z + np.log(g))
+
+        values = a + (d - a) * np.exp(-log_s / g)
+        values_1st = (d - a) * b * np.exp(z - (1/g + 1) * log_s)
+        values_2nd = (d - a) * b**2 * (
+                np.exp(2 * z - (1/g + 2) * log_s) - np.exp(z - (1/g + 2) * log_s)
+                )
+    return values, values_1st, values_2nd
+
+
+# shared pieces of the gompertz / richards guesses: asymptotes just outside
+# the range of y, and the points far enough from both to linearise
+def _asymptote_guess(y):
+    y_min, y_max = np.min(y), np.max(y)
+    span = max(y_max - y_min, 1e-6)
+    lo, hi = y_min - 0.01 * span, y_max + 0.01 * span
+    inside = (y > y_min + 0.05 * span) & (y < y_max - 0.05 * span)
+    return lo, hi, span, inside
+
+
+# rate and location from a line through the linearised points, or a curve
+# rising over the observed days if there are too few of them
+def _linear_guess(x_inside, linearised, x):
+    if len(x_inside) >= 2:
+        slope, intercept = np.polyfit(x_inside, linearised, 1)
+        if slope > 0:
+            return slope, -intercept / slope
+    return 4 / max(np.ptp(x), 1e-6), np.median(x)
+
+
+def _sigmoid_start(x, y, span, p0):
+    x_max = max(np.max(np.abs(x)), 1e-6)
+    lower = [np.min(y) - span, 1e-4, -x_max, np.min(y)]
+    upper = [np.max(y), 10.0, 10 * x_max, np.max(y) + span]
+    return np.clip(p0, lower, upper), (lower, upper)
+
+
+# a growth model: the vectorized function f(x, *params), its jacobian
+# (points x params, or plants x points x params for parameter columns), curve / first / second derivative on a grid in one
+# pass, and data-driven starting values and bounds (p0, (lower, upper))
+class GrowthModel(NamedTuple):
+    name: str
+    param_names: tuple
+    func: Callable
+    jac: Callable
+    evaluate: Callable
+    guess: Callable
+
+
+models = {
+        model.name: model for model in [
+            GrowthModel("4pl", ("a", "b", "c", "d"), four_log_func, four_log_jac, evaluate_four_log, four_log_guess),
+            GrowthModel("5pl", ("a", "b", "c", "d", "g"), five_log_func, five_log_jac, evaluate_five_log, five_log_guess),
+            GrowthModel("gompertz", ("a", "b", "c", "d"), gompertz_func, gompertz_jac, evaluate_gompertz, gompertz_guess),
+            GrowthModel("richards", ("a", "b", "c", "d", "g"), richards_func, richards_jac, evaluate_richards, richards_guess),
+            ]
+        }
+
+# parameter rows of a table holding fits of several models
+param_names = ("a", "b", "c", "d", "g")
+
+
+# registered model by name, by its function, or the model itself
+def get_model(model):
+    if isinstance(model, GrowthModel):
+        return model
+    if callable(model):
+        for registered in models.values():
+            if registered.func is model:
+                return registered
+        raise ValueError(f"unregistered model function: {model.__name__}")
+    try:
+        return models[model]
+    except KeyError:
+        raise ValueError(f"unknown model: {model}") from None
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import base64
+import io
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple
+
+import numpy as np
+
+from dataset_store import Dataset
+
+
+# what reading one upload took
+class IngestReport(NamedTuple):
+    filename: str
+    plants: int
+    time_points: int
+    dropped_rows: int
+    missing_values: int
+    seconds: float
+    peak_bytes: int
+    peak_rss_bytes: int
+
+    def summary(self):
+        text = f"{self.filename}: {self.plants} plants x {self.time_points} time points"
+        if self.dropped_rows:
+            text += f", {self.dropped_rows} rows without x dropped"
+        if self.missing_values:
+            text += f", {self.missing_values} missing values"
+        text += f", parsed in {self.seconds:.2f}s"
+        if self.peak_bytes:
+            text += f", peak {self.peak_bytes / 2**20:.1f} MB"
+        if self.peak_rss_bytes:
+            text += f", process peak RSS {self.peak_rss_bytes / 2**20:.0f} MB"
+        return text
+
+
+# high-water mark of the process resident memory (0 where unavailable)
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# dcc.Upload contents ("data:<type>;base64,<data>"), decoded once to bytes
+def read_upload(contents, filename, dtype=np.float64, measure_memory=False):
+    _, content_string = contents.split(",", 1)
+    return read_table(base64.b64decode(content_string), filename, dtype, measure_memory)
+
+
+# read a csv / xlsx table (bytes or a path) straight into a Dataset with a
+# compact (plants x time points) array of dtype. rows without an x value are
+# dropped; a missing plant value stays nan and only that plant skips the
+# point when fitting. the report always has the process peak RSS;
+# measure_memory also traces the parse's own peak allocation (several times slower)
+def read_table(source, filename, dtype=np.float64, measure_memory=False):
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        handle = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        name = filename.lower()
+        if "csv" in name:
+            header, table = _read_csv(handle, dtype)
+        elif name.endswith((".xlsx", ".xlsm")):
+            header, table = _read_xlsx(handle, dtype)
+        elif "xls" in name:
+            # legacy .xls is not readable by openpyxl
+            import pandas as pd
+
+            df = pd.read_excel(handle)
+            header, table = [str(column) for column in df.columns], df.to_numpy(dtype=dtype)
+        else:
+            raise ValueError(f"unsupported file type: {filename}")
+        dataset, dropped = _to_dataset(header, table, dtype)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if measure_memory else 0
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+
+    report = IngestReport(
+            filename=filename, plants=len(dataset.names), time_points=len(dataset.x),
+            dropped_rows=dropped, missing_values=int(np.count_nonzero(np.isnan(dataset.values))),
+            seconds=seconds, peak_bytes=peak, peak_rss_bytes=peak_rss_bytes(),
+            )
+    return dataset, report
+
+
+# pandas is only imported for csv / xls uploads
+def _read_csv(handle, dtype):
+    import pandas as pd
+
+    df = pd.read_csv(handle, dtype=dtype, engine="c")
+    return [str(column) for column in df.columns], df.to_numpy(dtype=dtype)
+
+
+# openpyxl read-only mode streams the sheet row by row instead of loading
+# the whole workbook; cells go straight into a float array
+def _read_xlsx(handle, dtype):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(handle, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+
+        table = []
+        for row in rows:
+            if not any(value is not None for value in row):
+                continue
+            line = np.full(width, np.nan, dtype=dtype)
+            for i, value in enumerate(row[:width]):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    line[i] = value
+            table.append(line)
+    finally:
+        workbook.close()
+
+    table = np.vstack(table) if table else np.empty((0, width), dtype=dtype)
+    return [str(column) for column in header], table
+
+
+def _to_dataset(header, table, dtype):
+    if "x" not in header:
+        raise ValueError("the first row needs an \"x\" column")
+    x_column = header.index("x")
+    x = table[:, x_column].astype(np.float64)
+    keep = np.isfinite(x)
+
+    plant_columns = [i for i in range(len(header)) if i != x_column]
+    values = np.ascontiguousarray(table[keep][:, plant_columns].T, dtype=dtype)
+    names = [header[i] for i in plant_columns]
+    return Dataset(x[keep], names, values), int(np.count_nonzero(~keep))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+
+# switchable timing of the pipeline stages and app callbacks. off by
+# default; GCURVE_METRICS=1 (or enable()) turns it on. GCURVE_METRICS_LOG
+# appends every timing as a json line to that file
+enabled = os.environ.get("GCURVE_METRICS", "0") not in ("", "0", "false")
+logger = logging.getLogger("gcurve.metrics")
+if os.environ.get("GCURVE_METRICS_LOG"):
+    _handler = logging.FileHandler(os.environ["GCURVE_METRICS_LOG"])
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# stage -> [calls, total seconds, max seconds, last seconds]
+stage_times = {}
+# event counters, e.g. fits, fit_nfev, fit_njev, fit_failures
+counters = Counter()
+# caches with hits / misses attributes (FitCache), by name
+caches = {}
+_lock = threading.Lock()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        stage_times.clear()
+        counters.clear()
+
+
+def watch_cache(name, cache):
+    caches[name] = cache
+
+
+def record(stage, seconds, **fields):
+    with _lock:
+        times = stage_times.setdefault(stage, [0, 0.0, 0.0, 0.0])
+        times[0] += 1
+        times[1] += seconds
+        times[2] = max(times[2], seconds)
+        times[3] = seconds
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"time": time.time(), "stage": stage, "seconds": seconds, **fields}, default=str))
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            counters[name] += n
+
+
+class _Timer:
+    __slots__ = ("stage", "fields", "start")
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start, **self.fields)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+# with timed("fit"): ... records the block's wall time under the stage;
+# a shared no-op when instrumentation is off
+def timed(stage, **fields):
+    if not enabled:
+        return _no_timer
+    return _Timer(stage, fields)
+
+
+# everything recorded so far, as plain data
+def snapshot():
+    with _lock:
+        stages = {
+                stage: {"calls": calls, "seconds": total, "mean": total / calls, "max": longest, "last": last}
+                for stage, (calls, total, longest, last) in stage_times.items()
+                }
+        counts = dict(counters)
+    cache_stats = {}
+    for name, cache in caches.items():
+        lookups = cache.hits + cache.misses
+        cache_stats[name] = {
+                "hits": cache.hits, "misses": cache.misses, "size": len(cache),
+                "hit_rate": cache.hits / lookups if lookups else None,
+                }
+    return {"enabled": enabled, "stages": stages, "counters": counts, "caches": cache_stats}
+
+
+# prometheus text exposition format of snapshot()
+def prometheus_text():
+    state = snapshot()
+    stages, cache_stats = state["stages"].items(), state["caches"].items()
+    lines = []
+
+    def metric(name, kind, description, label, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in samples)
+
+    metric("gcurve_stage_seconds_total", "counter", "Wall time spent per stage.", "stage",
+           [(stage, f"{s['seconds']:.6f}") for stage, s in stages])
+    metric("gcurve_stage_calls_total", "counter", "Timed calls per stage.", "stage",
+           [(stage, s["calls"]) for stage, s in stages])
+    metric("gcurve_stage_seconds_max", "gauge", "Longest call per stage.", "stage",
+           [(stage, f"{s['max']:.6f}") for stage, s in stages])
+    metric("gcurve_events_total", "counter", "Counted events (fits, fit_nfev, ...).", "event",
+           state["counters"].items())
+    metric("gcurve_cache_hits_total", "counter", "Cache hits.", "cache", [(name, c["hits"]) for name, c in cache_stats])
+    metric("gcurve_cache_misses_total", "counter", "Cache misses.", "cache",
+           [(name, c["misses"]) for name, c in cache_stats])
+    metric("gcurve_cache_entries", "gauge", "Entries held in memory.", "cache",
+           [(name, c["size"]) for name, c in cache_stats])
+    return "\n".join(lines) + "\n"
+
+
+# fixed-width text table of snapshot(), for the app's debug panel
+def text_report():
+    state = snapshot()
+    lines = [f"{'stage':28s} {'calls':>7s} {'mean ms':>9s} {'max ms':>9s} {'last ms':>9s}"]
+    for stage, s in sorted(state["stages"].items()):
+        lines.append(
+                f"{stage:28s} {s['calls']:7d} {s['mean'] * 1e3:9.2f} {s['max'] * 1e3:9.2f} {s['last'] * 1e3:9.2f}"
+                )
+    lines.append("")
+    for name, c in state["caches"].items():
+        rate = "-" if c["hit_rate"] is None else f"{c['hit_rate']:.0%}"
+        lines.append(f"{name} cache: {c['hits']} hits, {c['misses']} misses ({rate}), {c['size']} entries")
+    if state["counters"]:
+        lines.append("")
+        lines += [f"{name}: {value}" for name, value in sorted(state["counters"].items())]
+    fits = state["counters"].get("fits")
+    if fits:
+        lines.append(f"mean nfev per fit: {state['counters'].get('fit_nfev', 0) / fits:.1f}")
+    return "\n".join(lines)
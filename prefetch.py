@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from utility_funcs import prefetch_fits, prefetch_task, store_prefetched
+
+
+# fits every plant of the latest upload in the background so the slider
+# finds them in the fit cache. a pool of worker processes (spawned on the
+# first upload) keeps one plant per worker in flight; each free worker takes
+# the queued plant nearest to the slider position, after it rather than
+# before it on ties. a new upload replaces the queue, plants already in
+# flight are still finished and cached. workers=0 turns prefetching off
+class Prefetcher:
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._lock = threading.RLock()
+        self._key = None
+        self._data = None
+        # plant indices of the current upload not handed to the pool yet
+        self._queue = []
+        self._focus = 0
+        # plant -> event set once its fits are cached, for plants in flight
+        self._in_flight = {}
+        self._pool = None
+        atexit.register(self.stop)
+
+    # prefetch upload key. the plant at focus is left out, the caller is
+    # about to show it and fits it faster than a freshly spawned worker
+    def start(self, key, data, focus=0):
+        if self.workers <= 0:
+            return
+        with self._lock:
+            self._key = key
+            self._data = data
+            self._queue = [index for index in range(len(data.names)) if index != focus]
+            self._focus = focus
+            self._in_flight = {}
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._fill()
+
+    # slider moved to the plant at index of upload key
+    def focus(self, key, index):
+        with self._lock:
+            if key == self._key:
+                self._focus = index
+
+    # block until the fits of plant (of upload key) are cached if it is in
+    # flight; False right away if it is not, the caller then fits it itself
+    def wait(self, key, plant, timeout=None):
+        with self._lock:
+            ready = self._in_flight.get(plant) if key == self._key else None
+        if ready is None:
+            return False
+        with instrumentation.timed("prefetch_wait"):
+            return ready.wait(timeout)
+
+    def stop(self):
+        with self._lock:
+            self._queue = []
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    # hand queued plants to free workers, nearest to the focus first.
+    # called with the lock held
+    def _fill(self):
+        data = self._data
+        while self._queue and len(self._in_flight) < self.workers:
+            index = min(self._queue, key=lambda i: (abs(i - self._focus), i < self._focus))
+            self._queue.remove(index)
+            plant = data.names[index]
+            prefetch = prefetch_task(data.x, data.values[index])
+            if prefetch is None:
+                continue
+            keys, task = prefetch
+            try:
+                future = self._pool.submit(prefetch_fits, task)
+            except RuntimeError as e:
+                # a broken pool (a worker died) stops prefetching until the next upload
+                print(f"Warning: prefetching stopped, {type(e).__name__}: {e}!!!")
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self._queue = []
+                return
+            ready = threading.Event()
+            self._in_flight[plant] = ready
+            future.add_done_callback(functools.partial(self._done, self._key, plant, keys, ready))
+
+    # runs in the pool's result thread
+    def _done(self, key, plant, keys, ready, future):
+        try:
+            store_prefetched(keys, future.result())
+            instrumentation.count("prefetched")
+        except Exception as e:
+            if not future.cancelled():
+                print(f"Warning: prefetching {plant} failed, {type(e).__name__}: {e}!!!")
+        finally:
+            ready.set()
+            with self._lock:
+                if key == self._key:
+                    self._in_flight.pop(plant, None)
+                    if self._pool is not None:
+                        self._fill()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# production serving: several gunicorn worker processes behind one port,
+# so fitting is spread over the cores instead of one dev-server process.
+#
+#   python serve.py --workers 4 --port 8050
+#   gunicorn -w 4 -b 0.0.0.0:8050 'serve:wsgi_app()'
+#
+# the callbacks keep no state in the process: uploaded datasets, fits and
+# export jobs live under GCURVE_STATE_DIR (datasets/, fits.sqlite, jobs/),
+# which every worker reads and writes, so any worker can serve any request.
+# figure caches and metrics stay per worker. each worker prefetches the
+# uploads it receives with GCURVE_PREFETCH_WORKERS processes (default 1 here)
+
+import argparse
+import os
+import tempfile
+
+
+state_dir = os.environ.setdefault("GCURVE_STATE_DIR", os.path.join(tempfile.gettempdir(), "gcurve"))
+os.makedirs(state_dir, exist_ok=True)
+os.environ.setdefault("GCURVE_DATA_DIR", os.path.join(state_dir, "datasets"))
+os.environ.setdefault("GCURVE_JOBS_DIR", os.path.join(state_dir, "jobs"))
+os.environ.setdefault("GCURVE_FIT_CACHE_PATH", os.path.join(state_dir, "fits.sqlite"))
+os.environ.setdefault("GCURVE_PREFETCH_WORKERS", "1")
+
+
+# the wsgi application, imported in each worker after the fork so every
+# process opens its own sqlite connections and pools
+def wsgi_app():
+    from app import server
+
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the gcurve app with several worker processes.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="request threads per worker")
+    parser.add_argument("--timeout", type=int, default=300, help="seconds before a stuck worker is restarted")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # gunicorn is only needed for serving, not for the app or batch mode
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("timeout", args.timeout)
+            self.cfg.set("preload_app", False)
+
+        def load(self):
+            return wsgi_app()
+
+    Application().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,344 +1,1134 @@
 #!/usr/bin/env python # -*- coding: utf-8 -*-
 
-import sympy
+import copy
+import os
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
+
 import numpy as np 
-import pandas as pd
 
-from scipy.optimize import curve_fit
+import instrumentation
+from batch_solver import levenberg_marquardt
+from fit_cache import FitCache, fit_key
+from growth_models import (
+        evaluate_five_log, five_log_func, five_log_guess, five_log_jac, get_model, models, param_names,
+        )
 
-import plotly.graph_objects as go 
-from plotly.subplots import make_subplots
 
+# evaluation grid (days): uniform from start to stop with num points or a
+# fixed step, or adaptive, where the same number of points is spread by
+# curvature (|f''| plus a uniform floor) so they crowd around the
+# inflection instead of needing a dense uniform grid
+class GridSpec(NamedTuple):
+    start: float = 0.0
+    stop: float = 129.0
+    num: int = 130
+    step: float = None
+    adaptive: bool = False
 
-# 5 parameters logsitic 
-def five_log_func(x, a, b, c, d, g):
-    return d + (a - d)/(1 + (x/c)**b)**g
+    def uniform(self):
+        if self.step:
+            return np.arange(self.start, self.stop + self.step / 2, self.step)
+        return np.linspace(self.start, self.stop, self.num)
 
+    def points(self, params=None, model="5pl"):
+        uniform = self.uniform()
+        if not self.adaptive or params is None or not np.all(np.isfinite(params)):
+            return uniform
 
-# curve fitting
-def curve_fitting(x, y, func=five_log_func, method="trf", maxfev=5000):
+        curvature = np.nan_to_num(np.abs(get_model(model).evaluate(uniform, *params)[2]), posinf=0.0)
+        density = 0.2 + curvature / max(np.max(curvature), 1e-12)
+        cdf = np.concatenate([[0.0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(uniform))])
+        return np.interp(np.linspace(0, cdf[-1], len(uniform)), cdf, uniform)
+
+
+default_grid = GridSpec()
+default_interval = default_grid.uniform()
+
+# y axis range of the growth function plot
+default_y_range = (-5, 150)
+
+# fit cache shared by the app callbacks and the save_* exports.
+# GCURVE_FIT_CACHE_PATH enables on-disk persistence (sqlite file), shared by
+# every process using the same file (app.py defaults it)
+fit_cache = FitCache(
+        maxsize=int(os.environ.get("GCURVE_FIT_CACHE_SIZE", 4096)),
+        path=os.environ.get("GCURVE_FIT_CACHE_PATH") or None,
+        )
+
+
+# small LRU of built figures, keyed by fit and threshold
+figure_cache = FitCache(maxsize=64)
+
+# how often each pipeline stage (fit -> grid -> t_values -> figure) actually
+# ran, i.e. was not served from a cache. counted per plant
+stage_runs = Counter()
+
+
+instrumentation.watch_cache("fit", fit_cache)
+instrumentation.watch_cache("figure", figure_cache)
+
+
+def stage_counts():
+    return dict(stage_runs)
+
+
+def reset_stage_counts():
+    stage_runs.clear()
+
+
+# t value extraction: "grid" picks grid points, "root" refines them to
+# fractional days by root finding on the analytic derivatives
+default_t_method = os.environ.get("GCURVE_T_METHOD", "grid")
+default_t_xtol = 1e-6
+
+
+# batch fitting pool: "process", "thread" or "serial"
+batch_executor = os.environ.get("GCURVE_EXECUTOR", "process")
+batch_workers = int(os.environ.get("GCURVE_WORKERS", os.cpu_count() or 1))
+batch_chunksize = 8
+
+# fitting mode: "default" is curve_fit with its own defaults (all-ones start,
+# finite-difference jacobian); "guided" adds the analytic jacobian and
+# data-driven initial guesses and bounds
+default_fit_mode = os.environ.get("GCURVE_FIT_MODE", "default")
+
+# solver for the plants missing from the fit cache: "pool" fits them one by
+# one with curve_fit on the batch pool; "batched" runs one vectorized
+# levenberg-marquardt (batch_solver) over all of them per model, starting
+# from the model's guess, and passes only the plants it does not converge on
+# within batch_max_iterations on to the pool
+default_solver = os.environ.get("GCURVE_SOLVER", "pool")
+batch_max_iterations = 200
+
+# growth model, one of growth_models.models, or "best" to fit every
+# candidate and keep the one with the lowest information criterion
+# ("aic" or "bic") per plant
+default_model = os.environ.get("GCURVE_MODEL", "5pl")
+default_criterion = os.environ.get("GCURVE_CRITERION", "aic")
+model_candidates = tuple(models)
+
+# bootstrap confidence intervals: resamples per plant, "residual" (fitted
+# curve plus resampled residuals) or "case" (resampled points), confidence
+# level and seed. a plant's resamples depend only on the seed and its data,
+# not on the plate or the pool
+bootstrap_resamples = int(os.environ.get("GCURVE_BOOTSTRAP_RESAMPLES", 200))
+bootstrap_kind = os.environ.get("GCURVE_BOOTSTRAP_KIND", "residual")
+bootstrap_level = float(os.environ.get("GCURVE_BOOTSTRAP_LEVEL", 0.95))
+bootstrap_seed = int(os.environ.get("GCURVE_BOOTSTRAP_SEED", 0))
+
+
+# fit result: fitted once, then serves curve, derivatives, t values and
+# parameters on demand. the grids are evaluated on first access only
+class FitResult:
+    def __init__(self, params, covariance=None, converged=True, message="", grid=None,
+                 nfev=0, njev=0, elapsed=0.0, model="5pl", sse=np.nan, n_obs=0):
+        self.params = np.asarray(params, dtype=float)
+        self.model = model
+        # residual sum of squares over the n_obs points fitted
+        self.sse = sse
+        self.n_obs = n_obs
+        self.covariance = covariance
+        self.converged = converged
+        self.message = message
+        # model / jacobian evaluations and wall time spent in the fit
+        self.nfev = nfev
+        self.njev = njev
+        self.elapsed = elapsed
+        self.grid_spec = default_grid if grid is None else grid
+        self.key = None
+        self._reset()
+
+    def _reset(self):
+        self._interval = None
+        self._grid = None
+        self._t_values = {}
+        self._views = {}
+
+    # grids are cheap to recompute, keep pickles (disk cache, workers) small
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_interval=None, _grid=None, _t_values={}, _views={})
+        return state
+
+    # results pickled before models were selectable are 5pl fits
+    def __setstate__(self, state):
+        self.__dict__.update({"model": "5pl", "sse": np.nan, "n_obs": 0}, **state)
+
+    # the same fit evaluated on another grid; views are kept per grid spec
+    def with_grid(self, grid=None):
+        grid = default_grid if grid is None else grid
+        if grid == self.grid_spec:
+            return self
+        if grid not in self._views:
+            view = copy.copy(self)
+            view.grid_spec = grid
+            view._reset()
+            self._views[grid] = view
+        return self._views[grid]
+
+    @property
+    def interval(self):
+        if self._interval is None:
+            self._interval = self.grid_spec.points(self.params, self.model)
+        return self._interval
+
+    @property
+    def param_names(self):
+        return get_model(self.model).param_names
+
+    @property
+    def parameters(self):
+        return dict(zip(self.param_names, self.params))
+
+    # akaike / bayesian information criterion of the fit (gaussian errors),
+    # inf for failed fits so they never win a model selection
+    def information_criterion(self, criterion=None):
+        criterion = default_criterion if criterion is None else criterion
+        n, k = self.n_obs, len(self.params)
+        if not self.converged or n <= 0 or not np.isfinite(self.sse):
+            return np.inf
+        fit_term = n * np.log(max(self.sse, np.finfo(float).tiny) / n)
+        if criterion == "aic":
+            return fit_term + 2 * k
+        elif criterion == "bic":
+            return fit_term + k * np.log(n)
+        raise ValueError(f"unknown information criterion: {criterion}")
+
+    @property
+    def grid(self):
+        if self._grid is None:
+            stage_runs["grid"] += 1
+            with instrumentation.timed("grid"):
+                self._grid = get_model(self.model).evaluate(self.interval, *self.params)
+        return self._grid
+
+    @property
+    def values(self):
+        # clipped at zero; a failed fit keeps its nan curve
+        return np.maximum(self.grid[0], 0.0)
+
+    @property
+    def values_1st(self):
+        return self.grid[1]
+
+    @property
+    def values_2nd(self):
+        return self.grid[2]
+
+    # t values are cached per threshold and method, a new threshold reuses the grids
+    def t_values(self, threshold=0.005, method=None, xtol=default_t_xtol):
+        method = default_t_method if method is None else method
+        key = (float(threshold), method, xtol)
+        if key not in self._t_values:
+            stage_runs["t_values"] += 1
+            if method not in ("root", "grid"):
+                raise ValueError(f"unknown t value method: {method}")
+            values_1st, values_2nd = self.values_1st, self.values_2nd
+            with instrumentation.timed("t_values", method=method):
+                if method == "root":
+                    self._t_values[key] = t_value_root(
+                            self.params, self.interval, values_1st, values_2nd, threshold, xtol, self.model,
+                            )
+                else:
+                    self._t_values[key] = t_value_func(values_1st, values_2nd, threshold, self.interval)
+        return self._t_values[key]
+
+
+# fit a single plant; failures give a non-converged result with nan parameters.
+# model is a name from growth_models.models (default_model if None) or "best"
+# to fit each of model_candidates and keep the one with the lowest criterion.
+# results are looked up in / stored to the shared fit cache unless use_cache is
+# False. the result is evaluated on grid (a GridSpec, default_grid if None).
+# solver is "pool" or "batched" (default_solver if None), see default_solver
+def fit_plant(x, y, model=None, method="trf", maxfev=5000, fit_mode=None, use_cache=True,
+              grid=None, criterion=None, solver=None):
+    model = default_model if model is None else model
+    fit_mode = default_fit_mode if fit_mode is None else fit_mode
+    solver = default_solver if solver is None else solver
+    if model == "best":
+        fits = [
+                fit_plant(x, y, name, method, maxfev, fit_mode, use_cache, grid, solver=solver)
+                for name in model_candidates
+                ]
+        return best_fit(fits, criterion)
+
+    model = get_model(model)
+    if not use_cache:
+        fit = _solve_plant(x, y, model, method, maxfev, fit_mode, solver)
+        _count_fit(fit)
+        return fit.with_grid(grid)
+
+    key = _fit_key(x, y, model, method, maxfev, fit_mode, solver)
+    fit = _cached_fit(key)
+    if fit is None:
+        fit = _solve_plant(x, y, model, method, maxfev, fit_mode, solver)
+        _count_fit(fit)
+        fit.key = key
+        fit_cache.put(key, fit)
+    return fit.with_grid(grid)
+
+
+# 5pl keys are the ones from before models were selectable, and pool keys the
+# ones from before the batched solver, so cached fits stay valid
+def _fit_key(x, y, model, method, maxfev, fit_mode, solver="pool"):
+    settings = dict(method=method, maxfev=maxfev, fit_mode=fit_mode)
+    if solver != "pool":
+        settings["solver"] = solver
+    return fit_key(x, y, model.func.__name__, **settings)
+
+
+def _solve_plant(x, y, model, method, maxfev, fit_mode, solver):
+    if solver == "batched":
+        fit = _fit_batched(x, [y], model)[0]
+        if fit is not None:
+            return fit
+    elif solver != "pool":
+        raise ValueError(f"unknown solver: {solver}")
+    return _fit_plant(x, y, model, method, maxfev, fit_mode)
+
+
+# p0, if given, replaces the fit mode's starting values (a warm start)
+def _fit_plant(x, y, model, method, maxfev, fit_mode="default", p0=None):
+    model = get_model(model)
+    n_params = len(model.param_names)
+    # a missing value only drops that point, for this plant
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    observed = np.isfinite(x) & np.isfinite(y)
+    x, y = x[observed], y[observed]
+    if len(x) < n_params:
+        message = f"only {len(x)} data points"
+        print(f"Warning: {message}!!!")
+        return FitResult(np.full(n_params, np.nan), converged=False, message=message, model=model.name)
+
+    # count every model / jacobian call, including finite-difference ones
+    counts = {"nfev": 0, "njev": 0}
+
+    def counted_func(x, *params):
+        counts["nfev"] += 1
+        return model.func(x, *params)
+
+    if fit_mode == "default":
+        # curve_fit's own default start, spelled out since counted_func hides
+        # the signature. all ones only suits the 5pl, the others start from their guess
+        kwargs = dict(p0=np.ones(n_params) if model.name == "5pl" else model.guess(x, y)[0])
+    elif fit_mode == "guided":
+        def counted_jac(x, *params):
+            counts["njev"] += 1
+            return model.jac(x, *params)
+
+        p0, bounds = model.guess(x, y)
+        kwargs = dict(p0=p0, jac=counted_jac)
+        if method != "lm":
+            kwargs["bounds"] = bounds
+    else:
+        raise ValueError(f"unknown fit mode: {fit_mode}")
+    if p0 is not None:
+        kwargs["p0"] = np.clip(p0, *kwargs["bounds"]) if "bounds" in kwargs else np.asarray(p0, dtype=float)
+
+    # scipy.optimize takes longer to import than the rest of this module,
+    # it is only loaded once something is fitted
+    from scipy.optimize import curve_fit
+
+    start = time.perf_counter()
     try: 
-        params, _ = curve_fit(func, x, y, method=method, maxfev=maxfev)
-    except RuntimeError as e:
+        with instrumentation.timed("fit", model=model.name):
+            params, covariance = curve_fit(counted_func, x, y, method=method, maxfev=maxfev, **kwargs)
+    except (RuntimeError, ValueError) as e:
         print(f"Warning: {e}!!!")
+        return FitResult(
+                np.full(n_params, np.nan), converged=False, message=str(e),
+                elapsed=time.perf_counter() - start, model=model.name, **counts,
+                )
     else: 
-        return params
+        sse = float(np.sum((model.func(x, *params) - y)**2))
+        return FitResult(
+                params, covariance, elapsed=time.perf_counter() - start,
+                model=model.name, sse=sse, n_obs=len(x), **counts,
+                )
+
+
+# fit many plants (a sequence of y arrays on the shared x) of one model at
+# once with batch_solver.levenberg_marquardt. returns a FitResult per plant,
+# None for the plants it did not converge on (stragglers, to be fitted by
+# _fit_plant); elapsed is the plant's share of the batch's wall time
+def _fit_batched(x, ys, model):
+    model = get_model(model)
+    n_params = len(model.param_names)
+    x = np.asarray(x, dtype=float)
+    ys = np.array(ys, dtype=float).reshape(len(ys), -1)
+    observed = np.isfinite(x) & np.isfinite(ys)
+    fits = [None] * len(ys)
+    # plants short of points, or whose guess fails, are left to _fit_plant and its messages
+    rows, guesses = [], []
+    for row in np.flatnonzero(observed.sum(axis=1) >= n_params):
+        try:
+            guesses.append(model.guess(x[observed[row]], ys[row, observed[row]]))
+        except Exception:
+            continue
+        rows.append(row)
+    if not rows:
+        return fits
+
+    p0 = np.array([p0 for p0, _ in guesses])
+    lower = np.array([bounds[0] for _, bounds in guesses])
+    upper = np.array([bounds[1] for _, bounds in guesses])
+
+    start = time.perf_counter()
+    with instrumentation.timed("fit_batched", model=model.name, plants=len(rows)):
+        batch = levenberg_marquardt(model, x, ys[rows], p0, lower, upper, batch_max_iterations)
+    elapsed = (time.perf_counter() - start) / len(rows)
+    for i, row in enumerate(rows):
+        if batch.converged[i]:
+            fits[row] = FitResult(
+                    batch.params[i], batch.covariance[i], message="batched levenberg-marquardt",
+                    nfev=int(batch.nfev[i]), njev=int(batch.njev[i]), elapsed=elapsed,
+                    model=model.name, sse=float(batch.sse[i]), n_obs=int(batch.n_obs[i]),
+                    )
+    instrumentation.count("fit_stragglers", len(rows) - int(batch.converged.sum()))
+    return fits
+
+
+# fit and iteration counts for stage_counts and the instrumentation. pool
+# workers are separate processes, so fits are counted where their results arrive
+def _count_fit(fit):
+    stage_runs["fit"] += 1
+    instrumentation.count("fits")
+    instrumentation.count("fit_nfev", fit.nfev)
+    instrumentation.count("fit_njev", fit.njev)
+    if not fit.converged:
+        instrumentation.count("fit_failures")
+
+
+# the fit with the lowest information criterion (default_criterion if None);
+# the first one if none of them converged
+def best_fit(fits, criterion=None):
+    scores = [fit.information_criterion(criterion) for fit in fits]
+    return fits[int(np.argmin(scores))]
+
+
+# fit many plants sharing one x vector. cached plants are served from the fit
+# cache; with the batched solver the rest are fitted together per model
+# first, and what is left (all of them with the pool solver) is fitted in
+# chunks on a process or thread pool. results
+# are returned in the order of columns; a plant whose fit raises gets a
+# non-converged FitResult carrying the error instead of failing the batch.
+# with model "best" every (plant, candidate model) pair is a task of the same
+# pool, so selection adds the candidates' fitting work spread over the
+# workers instead of a pass per model.
+# progress, if given, is called as progress(plants_done, plants_total)
+# after the cache lookup and after every chunk; an exception it raises
+# (e.g. to cancel) stops the batch
+def fit_plants(x, columns, model=None, method="trf", maxfev=5000, fit_mode=None,
+               executor=None, max_workers=None, chunksize=None, grid=None, progress=None,
+               criterion=None, solver=None):
+    model = default_model if model is None else model
+    fit_mode = default_fit_mode if fit_mode is None else fit_mode
+    solver = default_solver if solver is None else solver
+    if solver not in ("pool", "batched"):
+        raise ValueError(f"unknown solver: {solver}")
+    executor = batch_executor if executor is None else executor
+    max_workers = batch_workers if max_workers is None else max_workers
+    chunksize = batch_chunksize if chunksize is None else chunksize
+    names = model_candidates if model == "best" else [get_model(model).name]
+
+    fits = {}
+    keys = {}
+    for plant, y in columns.items():
+        for name in names:
+            keys[plant, name] = _fit_key(x, y, models[name], method, maxfev, fit_mode, solver)
+            fits[plant, name] = _cached_fit(keys[plant, name])
+
+    pending = [pair for pair, fit in fits.items() if fit is None]
+    if solver == "batched":
+        for name in names:
+            batch = [pair for pair in pending if pair[1] == name]
+            if batch:
+                batch_fits = _fit_batched(x, [columns[plant] for plant, _ in batch], name)
+                solved = [(pair, fit) for pair, fit in zip(batch, batch_fits) if fit is not None]
+                _store_chunk(fits, keys, [pair for pair, _ in solved], [fit for _, fit in solved])
+        pending = [pair for pair, fit in fits.items() if fit is None]
+    chunks = [pending[i:i + chunksize] for i in range(0, len(pending), chunksize)]
+    tasks = [
+            (x, [(columns[plant], name) for plant, name in chunk], method, maxfev, fit_mode)
+            for chunk in chunks
+            ]
+
+    done = len(fits) - len(pending)
+    if progress is not None:
+        progress(done // len(names), len(columns))
+
+    def store(index, chunk_fits):
+        nonlocal done
+        _store_chunk(fits, keys, chunks[index], chunk_fits)
+        done += len(chunks[index])
+        if progress is not None:
+            progress(done // len(names), len(columns))
+
+    with instrumentation.timed("fit_plants", plants=len(columns), fitted=len(pending)):
+        _run_tasks(_fit_chunk, tasks, store, executor, max_workers)
+    return {
+            plant: best_fit([fits[plant, name] for name in names], criterion).with_grid(grid)
+            for plant in columns
+            }
+
+
+# run func over tasks serially or on a process / thread pool, calling
+# on_result(task_index, result) in task order. an exception raised by
+# on_result cancels the tasks not started yet and propagates
+def _run_tasks(func, tasks, on_result, executor, max_workers):
+    if executor == "serial" or max_workers <= 1 or len(tasks) <= 1:
+        for index, task in enumerate(tasks):
+            on_result(index, func(task))
+        return
+
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    with pool_class(max_workers=min(max_workers, len(tasks))) as pool:
+        try:
+            for index, result in enumerate(pool.map(func, tasks)):
+                on_result(index, result)
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _fit_chunk(task):
+    x, items, method, maxfev, fit_mode = task
+    chunk_fits = []
+    for y, name in items:
+        try:
+            fit = _fit_plant(x, y, name, method, maxfev, fit_mode)
+        except Exception as e:
+            fit = FitResult(
+                    np.full(len(models[name].param_names), np.nan),
+                    converged=False, message=f"{type(e).__name__}: {e}", model=name,
+                    )
+        chunk_fits.append(fit)
+    return chunk_fits
+
+
+def _store_chunk(fits, keys, chunk, chunk_fits):
+    for pair, fit in zip(chunk, chunk_fits):
+        _count_fit(fit)
+        fit.key = keys[pair]
+        fits[pair] = fit
+    fit_cache.put_many((fit.key, fit) for fit in chunk_fits)
+
+
+# fitting ahead of fit_plant in other processes (prefetch.py): prefetch_task
+# gives the cache keys fit_plant(x, y) would miss and a task computing those
+# fits, prefetch_fits runs the task in any process and store_prefetched puts
+# its results into the fit cache. None if nothing is missing
+def prefetch_task(x, y, model=None, method="trf", maxfev=5000, fit_mode=None, solver=None):
+    model = default_model if model is None else model
+    fit_mode = default_fit_mode if fit_mode is None else fit_mode
+    solver = default_solver if solver is None else solver
+    names = model_candidates if model == "best" else [get_model(model).name]
+    keys = {name: _fit_key(x, y, models[name], method, maxfev, fit_mode, solver) for name in names}
+    missing = [name for name, key in keys.items() if not _is_cached(key)]
+    if missing:
+        return [keys[name] for name in missing], (x, y, missing, method, maxfev, fit_mode, solver)
+
+
+def prefetch_fits(task):
+    x, y, names, method, maxfev, fit_mode, solver = task
+    fits = []
+    for name in names:
+        try:
+            fit = _solve_plant(x, y, models[name], method, maxfev, fit_mode, solver)
+        except Exception as e:
+            fit = FitResult(
+                    np.full(len(models[name].param_names), np.nan),
+                    converged=False, message=f"{type(e).__name__}: {e}", model=name,
+                    )
+        fits.append(fit)
+    return fits
+
+
+def store_prefetched(keys, fits):
+    for key, fit in zip(keys, fits):
+        _count_fit(fit)
+        fit.key = key
+    fit_cache.put_many(zip(keys, fits))
+
+
+# incremental refits for an upload that appends time points to a previous
+# dataset (see Dataset.extends). every plant whose previous fit is in the fit
+# cache is refitted starting from the previous parameters, or not refitted
+# at all if each new point lies within tolerance times the previous fit's
+# rms residual of the previous curve (incremental_tolerance if None). plants
+# without a usable previous fit, or whose old points changed, are left to be
+# fitted from scratch.
+# these fits are approximations, so they are cached under incremental keys
+# (incremental_key of the new data's fit key) that only fit_plant, fit_plants
+# and the prefetcher of a process with GCURVE_INCREMENTAL=1 look up, ahead of
+# the exact key; everywhere else (the batch CLI, apps without incremental
+# uploads) the data gets fitted from scratch
+incremental_fits = os.environ.get("GCURVE_INCREMENTAL", "0") == "1"
+incremental_tolerance = float(os.environ.get("GCURVE_INCREMENTAL_TOLERANCE", 2.0))
+
+
+def incremental_key(key):
+    return "incremental-" + key
+
+
+def _is_cached(key):
+    return key in fit_cache or (incremental_fits and incremental_key(key) in fit_cache)
+
+
+# the cached fit for key, preferring the incremental one when they are used
+def _cached_fit(key):
+    if incremental_fits and incremental_key(key) in fit_cache:
+        return fit_cache.get(incremental_key(key))
+    return fit_cache.get(key)
+
+
+# plant counts of refit_incremental (with model "best" each candidate model
+# counts). saved_seconds estimates the time saved
+# as the previous fits' own fitting time minus the time taken here
+class IncrementalReport(NamedTuple):
+    refit: int
+    skipped: int
+    fresh: int
+    seconds: float
+    saved_seconds: float
+
+    def summary(self):
+        return (
+                f"{self.refit} plants refitted from their previous fit, {self.skipped} unchanged, "
+                f"{self.fresh} left to fit from scratch; {self.seconds:.2f}s, "
+                f"about {self.saved_seconds:.1f}s saved"
+                )
+
 
+def refit_incremental(previous, data, model=None, method="trf", maxfev=5000, fit_mode=None,
+                      solver=None, tolerance=None):
+    model = default_model if model is None else model
+    fit_mode = default_fit_mode if fit_mode is None else fit_mode
+    solver = default_solver if solver is None else solver
+    tolerance = incremental_tolerance if tolerance is None else tolerance
+    names = model_candidates if model == "best" else [get_model(model).name]
+    x_old, x_new = np.asarray(previous["x"], dtype=float), np.asarray(data["x"], dtype=float)
+    n = len(x_old)
+
+    counts = Counter()
+    results = []
+    previous_seconds = 0.0
+    start = time.perf_counter()
+    with instrumentation.timed("refit_incremental", plants=len(previous.names)):
+        for plant in previous.names:
+            y_old = np.asarray(previous[plant], dtype=float)
+            y_new = np.asarray(data[plant], dtype=float)
+            if not np.array_equal(y_new[:n], y_old, equal_nan=True):
+                counts["fresh"] += len(names)
+                continue
+            for name in names:
+                key = _fit_key(x_new, y_new, models[name], method, maxfev, fit_mode, solver)
+                cached = key in fit_cache or incremental_key(key) in fit_cache
+                old_key = _fit_key(x_old, y_old, models[name], method, maxfev, fit_mode, solver)
+                # the previous upload may have been fitted incrementally itself
+                old = fit_cache.get(incremental_key(old_key) if incremental_key(old_key) in fit_cache else old_key)
+                if cached or old is None or not old.converged or not old.n_obs:
+                    counts["skipped" if cached else "fresh"] += 1
+                    continue
+
+                previous_seconds += old.elapsed
+                observed = np.isfinite(x_new[n:]) & np.isfinite(y_new[n:])
+                residuals = y_new[n:][observed] - models[name].func(x_new[n:][observed], *old.params)
+                rms = np.sqrt(old.sse / old.n_obs)
+                if np.all(np.abs(residuals) <= tolerance * rms):
+                    fit = copy.copy(old)
+                    fit._reset()
+                    fit.sse = old.sse + float(np.sum(residuals**2))
+                    fit.n_obs = old.n_obs + len(residuals)
+                    fit.elapsed = 0.0
+                    fit.message = "kept, the new points lie on the previous curve"
+                    counts["skipped"] += 1
+                else:
+                    fit = _fit_plant(x_new, y_new, name, method, maxfev, fit_mode, p0=old.params)
+                    _count_fit(fit)
+                    if not fit.converged:
+                        counts["fresh"] += 1
+                        continue
+                    counts["refit"] += 1
+                fit.key = incremental_key(key)
+                results.append((fit.key, fit))
+        fit_cache.put_many(results)
+
+    seconds = time.perf_counter() - start
+    instrumentation.count("incremental_refits", counts["refit"])
+    instrumentation.count("incremental_skips", counts["skipped"])
+    return IncrementalReport(
+            counts["refit"], counts["skipped"], counts["fresh"], seconds, max(previous_seconds - seconds, 0.0),
+            )
+
+
+# curve fitting
+def curve_fitting(x, y, model=None, method="trf", maxfev=5000, fit_mode=None):
+    fit = fit_plant(x, y, model=model, method=method, maxfev=maxfev, fit_mode=fit_mode)
+    if fit.converged:
+        return fit.params
 
 
 # calculate values
-def generate_values(x_value, y_value):
-    a, b, c, d, g = curve_fitting(x_value, y_value)
-    default_interval = np.linspace(0, 129, 130)
-
-    x = sympy.Symbol("x")
-    func = d + (a - d)/(1 + (x/c)**b)**g
-
-    values = [func.subs({x: v}) for v in default_interval]
-    float_values = [float(v) if v > 0 else 0 for v in values]
-    return float_values
-
-def generate_values_1st(x_value, y_value):
-    a, b, c, d, g = curve_fitting(x_value, y_value)
-    default_interval = np.linspace(0, 129, 130)
-
-    x = sympy.Symbol("x")
-    func = d + (a - d)/(1 + (x/c)**b)**g
-
-    deriv_1st = func.diff()
-    values_1st = [deriv_1st.subs({x: v}) for v in default_interval]
-    float_values_1st = [float(v) for v in values_1st]
-    return float_values_1st
-
-
-def generate_values_2nd(x_value, y_value):
-    a, b, c, d, g = curve_fitting(x_value, y_value)
-    default_interval = np.linspace(0, 129, 130)
-
-    x = sympy.Symbol("x")
-    func = d + (a - d)/(1 + (x/c)**b)**g
-  
-    deriv_1st = func.diff()
-    deriv_2nd = deriv_1st.diff()
-    values_2nd = [deriv_2nd.subs({x: v}) for v in default_interval]
-    float_values_2nd = [float(v) for v in values_2nd]
-    return float_values_2nd 
-
-
-
-# generate t values 
-def t_value_func(values_1st, values_2nd, threshold=0.005):
-    # t2
-    t2_index = np.argmax(values_2nd)
-    t2_value = values_1st[t2_index]
-    # t3
-    t3_index = np.argmax(values_1st)
-    t3_value = np.max(values_1st)
-    # t4
-    t4_index = np.argmin(values_2nd)
-    t4_value = values_1st[t4_index]
-    # t1 
-    t1_index = [idx for idx in range(len(values_2nd)) if values_2nd[idx] > threshold][0]
-    t1_value = values_1st[t1_index]
-    # t5
-    t5_index = [idx for idx in range(len(values_2nd)-1, -1, -1) if values_2nd[idx] < -threshold][0]
-    t5_value = values_1st[t5_index]
+def generate_values(x_value, y_value, grid=None):
+    return fit_plant(x_value, y_value, grid=grid).values
+
+
+def generate_values_1st(x_value, y_value, grid=None):
+    return fit_plant(x_value, y_value, grid=grid).values_1st
+
+
+def generate_values_2nd(x_value, y_value, grid=None):
+    return fit_plant(x_value, y_value, grid=grid).values_2nd
+
+
+
+# t point index for plants whose threshold is never crossed (value is nan)
+T_MISSING = -1
+t_names = ["t1", "t2", "t3", "t4", "t5"]
+t_value_index = [f"{name}_{field}" for name in t_names for field in ("day", "value")]
+
+
+# generate t values for many plants at once. values_1st / values_2nd are
+# (plants x grid points); returns {"t1": (day, value), ...} with one entry
+# per plant in each array. t2 / t4 are the max / min of the second
+# derivative, t3 the max of the first, t1 / t5 the first / last points where
+# the second derivative exceeds +threshold / falls below -threshold.
+# days are taken from interval (shared 1-d or one row per plant), or are
+# grid indices if interval is None
+def t_values_batch(values_1st, values_2nd, threshold=0.005, interval=None):
+    values_1st = np.atleast_2d(np.asarray(values_1st, dtype=float))
+    values_2nd = np.atleast_2d(np.asarray(values_2nd, dtype=float))
+    rows = np.arange(values_1st.shape[0])
+    n_points = values_2nd.shape[1]
+
+    # all-nan rows (failed fits) have no t points at all
+    valid = np.isfinite(values_1st).any(axis=1) & np.isfinite(values_2nd).any(axis=1)
+    nan_2nd = np.isnan(values_2nd)
+
+    t2_index = np.argmax(np.where(nan_2nd, -np.inf, values_2nd), axis=1)
+    t3_index = np.argmax(np.where(np.isnan(values_1st), -np.inf, values_1st), axis=1)
+    t4_index = np.argmin(np.where(nan_2nd, np.inf, values_2nd), axis=1)
+
+    above = values_2nd > threshold
+    t1_index = np.where(above.any(axis=1), np.argmax(above, axis=1), T_MISSING)
+    below = values_2nd < -threshold
+    t5_index = np.where(below.any(axis=1), n_points - 1 - np.argmax(below[:, ::-1], axis=1), T_MISSING)
+
+    if interval is not None:
+        interval = np.broadcast_to(np.asarray(interval, dtype=float), values_1st.shape)
+
+    t_values = {}
+    for name, index in zip(t_names, [t1_index, t2_index, t3_index, t4_index, t5_index]):
+        index = np.where(valid, index, T_MISSING)
+        value = np.where(index != T_MISSING, values_1st[rows, index], np.nan)
+        if interval is not None:
+            index = np.where(index != T_MISSING, interval[rows, index], T_MISSING)
+        t_values[name] = (index, value)
+    return t_values
+
+
+# generate t values for a single plant
+def t_value_func(values_1st, values_2nd, threshold=0.005, interval=None):
+    batch = t_values_batch(values_1st, values_2nd, threshold, interval)
+    to_day = int if interval is None else float
+    t_values = {name: [to_day(day[0]), float(value[0])] for name, (day, value) in batch.items()}
+    return t_values
+    
+
+# t values as fractional days by root finding on the analytic derivatives.
+# the grid t points only bracket each root, so the cost per plant is a
+# handful of scalar evaluations whatever the grid density:
+#   t3      root of f'' around the grid max of f' (brentq)
+#   t2, t4  max / min of f'' around the grid points (bounded brent)
+#   t1, t5  crossings of f'' = +threshold / -threshold (brentq)
+def t_value_root(params, interval, values_1st, values_2nd, threshold=0.005, xtol=default_t_xtol,
+                 model="5pl"):
+    from scipy.optimize import brentq, minimize_scalar
+
+    evaluate = get_model(model).evaluate
+    interval = np.asarray(interval, dtype=float)
+    grid_t = t_value_func(values_1st, values_2nd, threshold)
+    last = len(interval) - 1
+
+    def deriv_1st(t):
+        return float(evaluate(t, *params)[1])
+
+    def deriv_2nd(t):
+        return float(evaluate(t, *params)[2])
+
+    def around(index):
+        return interval[max(index - 1, 0)], interval[min(index + 1, last)]
+
+    def root(func, lo, hi, fallback):
+        if lo < hi and func(lo) * func(hi) < 0:
+            return brentq(func, lo, hi, xtol=xtol)
+        return fallback
+
+    def extremum(func, lo, hi, fallback):
+        if lo < hi:
+            return minimize_scalar(func, bounds=(lo, hi), method="bounded", options={"xatol": xtol}).x
+        return fallback
+
+    days = {name: T_MISSING for name in t_names}
+    found = {name: t[0] for name, t in grid_t.items() if t[0] != T_MISSING}
+    if "t3" in found:
+        days["t3"] = root(deriv_2nd, *around(found["t3"]), interval[found["t3"]])
+    if "t2" in found:
+        days["t2"] = extremum(lambda t: -deriv_2nd(t), *around(found["t2"]), interval[found["t2"]])
+    if "t4" in found:
+        days["t4"] = extremum(deriv_2nd, *around(found["t4"]), interval[found["t4"]])
+    if "t1" in found:
+        index = found["t1"]
+        days["t1"] = root(
+                lambda t: deriv_2nd(t) - threshold,
+                interval[max(index - 1, 0)], interval[index], interval[index],
+                )
+    if "t5" in found:
+        index = found["t5"]
+        days["t5"] = root(
+                lambda t: deriv_2nd(t) + threshold,
+                interval[index], interval[min(index + 1, last)], interval[index],
+                )
 
     t_values = {
-            "t1": [t1_index, t1_value],
-            "t2": [t2_index, t2_value],
-            "t3": [t3_index, t3_value],
-            "t4": [t4_index, t4_value],
-            "t5": [t5_index, t5_value],
+            name: [float(day), deriv_1st(day)] if day != T_MISSING else [T_MISSING, np.nan]
+            for name, day in days.items()
             }
     return t_values
-    
 
-# generate plot 
-def plot_func(x_value, y_value, values, values_1st, values_2nd, threshold=0.005):
-    default_interval = np.linspace(0, 129, 130)
 
-    t_values = t_value_func(values_1st, values_2nd, threshold)
+# bootstrap distribution of one plant around its point estimate fit
+class BootstrapResult(NamedTuple):
+    # {name: (estimate, lower, upper)} for the model parameters and t1-t5 days
+    intervals: dict
+    # converged resamples x (parameters + t days), t days nan where missing
+    draws: np.ndarray
+    converged: int
+    resamples: int
 
-    fig = make_subplots(
-            rows=2, cols=2,
-            specs=[[{"colspan": 2}, None], [{}, {}]],
-            subplot_titles=("Growth Function", "Frist Derivative", "Second Derivative"),
-            row_heights=[0.6, 0.4] ,
-            )
 
-    # actual data
-    fig.add_trace(
-            go.Scatter(
-                x=x_value, y=y_value, mode="markers", 
-                marker=dict(size=8, color="red", opacity=0.5),
-                ),
-            row=1, col=1,
-            )
-    # infer data 
-    fig.add_trace(
-            go.Scatter(
-                x=default_interval, y=values, mode="lines",
-                line=dict(color="steelblue",),
-                ),
-            row=1, col=1 
-            )
-    # t1 line 
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t1"][0], t_values["t1"][0]],
-                y=[0, values[t_values["t1"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=1, col=1,
-            )
-    # t2 line 
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t2"][0], t_values["t2"][0]],
-                y=[0, values[t_values["t2"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=1, col=1,
-            )
-    # t3 line 
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t3"][0], t_values["t3"][0]],
-                y=[0, values[t_values["t3"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=1, col=1,
-            )
-    # t4 line 
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t4"][0], t_values["t4"][0]],
-                y=[0, values[t_values["t4"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=1, col=1,
-            )
-    # t5 line
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t5"][0], t_values["t5"][0]],
-                y=[0, values[t_values["t5"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=1, col=1,
-            )
+# bootstrap confidence intervals (percentile) for a plant's parameters and t
+# days. all resampled data sets are drawn at once and refitted together in
+# one batch_solver.levenberg_marquardt call (unbounded, analytic jacobian),
+# warm-started from fit.params, so a refit takes a handful of iterations.
+# residual resamples share x; a case resample is x repeated as often as the
+# most drawn point, with y masked (nan) beyond each point's draw count. tol
+# (ftol / xtol) is looser than curve_fit's 1e-8: along the flat c / g valley
+# of the 5pl that roughly halves the time and lets fewer resamples run out of
+# maxfev iterations. resamples that do not converge are left out and counted.
+# the t days of all resamples are then extracted in one t_values_batch call
+# on the fit's grid
+def bootstrap_plant(x, y, fit, n_resamples=None, kind=None, level=None, seed=None, threshold=0.005,
+                    maxfev=200, tol=1e-6):
+    n_resamples = bootstrap_resamples if n_resamples is None else n_resamples
+    kind = bootstrap_kind if kind is None else kind
+    level = bootstrap_level if level is None else level
+    seed = bootstrap_seed if seed is None else seed
+    model = get_model(fit.model)
+    names = list(model.param_names) + t_names
 
-    # annotation
-    fig.add_annotation(
-            x=t_values["t1"][0], y=values[t_values["t1"][0]],
-            text="t1",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=2,
-            row=1, col=1
-            )
-    fig.add_annotation(
-            x=t_values["t2"][0], y=values[t_values["t2"][0]],
-            text="t2",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=1, col=1
-            )
-    fig.add_annotation(
-            x=t_values["t3"][0], y=values[t_values["t3"][0]],
-            text="t3",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=1, col=1
-            )
-    fig.add_annotation(
-            x=t_values["t4"][0], y=values[t_values["t4"][0]],
-            text="t4",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=1, col=1
-            )
-    fig.add_annotation(
-            x=t_values["t5"][0], y=values[t_values["t5"][0]],
-            text="t5",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=1, col=1
-            )
-    fig.update_yaxes(
-            range=[-5, 150],
-            row=1, col=1,
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    observed = np.isfinite(x) & np.isfinite(y)
+    x, y = x[observed], y[observed]
+    draws = np.full((n_resamples, len(names)), np.nan)
+    if not fit.converged:
+        intervals = {name: (np.nan, np.nan, np.nan) for name in names}
+        return BootstrapResult(intervals, draws[:0], 0, n_resamples)
 
-            )
+    n_params = len(model.param_names)
+    rng = np.random.default_rng([seed, zlib.crc32(x.tobytes()), zlib.crc32(y.tobytes())])
+    fitted = model.func(x, *fit.params)
+    if kind == "residual":
+        xs = x
+        ys = fitted + rng.choice(y - fitted, size=(n_resamples, len(x)))
+        usable = np.full(n_resamples, len(np.unique(x)) >= n_params)
+    elif kind == "case":
+        index = rng.integers(0, len(x), size=(n_resamples, len(x)))
+        draw_counts = np.stack([np.bincount(row, minlength=len(x)) for row in index])
+        copies = np.arange(draw_counts.max())[:, None]
+        xs = np.tile(x, len(copies))
+        ys = np.where(draw_counts[:, None, :] > copies, y, np.nan).reshape(n_resamples, -1)
+        usable = np.array([len(np.unique(x[row > 0])) >= n_params for row in draw_counts])
+    else:
+        raise ValueError(f"unknown bootstrap kind: {kind}")
 
+    rows = np.flatnonzero(usable)
+    if rows.size:
+        p0 = np.broadcast_to(fit.params, (rows.size, n_params))
+        with instrumentation.timed("bootstrap_fit", model=model.name, resamples=rows.size):
+            batch = levenberg_marquardt(
+                    model, xs, ys[rows], p0, -np.inf, np.inf, max_iterations=maxfev, ftol=tol, xtol=tol,
+                    )
+        converged = batch.converged & np.all(np.isfinite(batch.params), axis=1)
+        draws[rows[converged], :n_params] = batch.params[converged]
 
-    # first derivative
-    fig.add_trace(
-            go.Scatter(
-                x=default_interval, y=values_1st, mode="lines",
-                line=dict(color="steelblue"),
-                ),
-            row=2, col=1,
-            )
+    draws = draws[np.isfinite(draws[:, 0])]
+    if len(draws):
+        interval = fit.interval
+        params = [p[:, None] for p in draws[:, :n_params].T]
+        _, values_1st, values_2nd = model.evaluate(interval, *params)
+        t_values = t_values_batch(values_1st, values_2nd, threshold, interval)
+        for j, name in enumerate(t_names):
+            day = t_values[name][0].astype(float)
+            draws[:, n_params + j] = np.where(day != T_MISSING, day, np.nan)
 
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t3"][0], t_values["t3"][0]],
-                y=[0, values_1st[t_values["t3"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=2, col=1,
-            )
-    fig.add_annotation(
-            x=t_values["t3"][0], y=values_1st[t_values["t3"][0]],
-            text="t3",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=2, col=1
-            )
+    estimates = list(fit.params) + [
+            day if day != T_MISSING else np.nan for day, _ in fit.t_values(threshold, "grid").values()
+            ]
+    intervals = {}
+    for j, name in enumerate(names):
+        column = draws[:, j][np.isfinite(draws[:, j])]
+        if len(column):
+            lower, upper = np.quantile(column, [(1 - level) / 2, (1 + level) / 2])
+        else:
+            lower = upper = np.nan
+        intervals[name] = (estimates[j], lower, upper)
+    return BootstrapResult(intervals, draws, len(draws), n_resamples)
 
 
-    # second derivative
-    fig.add_trace(
-            go.Scatter(
-                x=default_interval, y=values_2nd, mode="lines",
-                line=dict(color="steelblue"),
-                ),
-            row=2, col=2,
-            )
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t1"][0], t_values["t1"][0]],
-                y=[0, values_2nd[t_values["t1"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=2, col=2,
-            )
-    fig.add_trace(
-            go.Scatter(
-                x=[t_values["t5"][0], t_values["t5"][0]],
-                y=[0, values_2nd[t_values["t5"][0]]],
-                mode="lines",
-                line=dict(color="orange", dash="dash"),
-                ),
-            row=2, col=2,
-            )
-    fig.add_annotation(
-            x=t_values["t1"][0], y=values_2nd[t_values["t1"][0]],
-            text="t1",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=2, col=2,
-            )
-    fig.add_annotation(
-            x=t_values["t5"][0], y=values_2nd[t_values["t5"][0]],
-            text="t5",
-            font=dict(size=20),
-            showarrow=True, 
-            arrowhead=1,
-            row=2, col=2,
-            )
+# generate plot. values* are evaluated on interval (default_interval if None);
+# t_values (from t_value_func or t_value_root) are placed by day and default
+# to the grid t points
+def plot_func(x_value, y_value, values, values_1st, values_2nd, threshold=0.005, t_values=None,
+              interval=None, y_range=default_y_range):
+    # plotly is only needed for figures, headless use never imports it
+    import plotly.graph_objects as go 
+    from figures import full_figure
+
+    interval = default_interval if interval is None else np.asarray(interval, dtype=float)
+    if t_values is None:
+        t_values = t_value_func(values_1st, values_2nd, threshold, interval)
+    return go.Figure(full_figure(
+            x_value, y_value, interval, values, values_1st, values_2nd, t_values, y_range,
+            ))
 
-    fig.update_layout(
-            showlegend=False,
-            )
 
-    # fig.show()
-    return fig
+# figure (plain dict) for one plant on the fit's grid, cached per fit, grid,
+# threshold, t method and y range; only the skeleton fill runs on a miss
+def plant_figure(x_value, y_value, fit, threshold=0.005, t_method=None, y_range=default_y_range):
+    from figures import full_figure
 
+    t_method = default_t_method if t_method is None else t_method
 
-def save_infer_values(data):
+    def build():
+        stage_runs["figure"] += 1
+        values, values_1st, values_2nd = fit.values, fit.values_1st, fit.values_2nd
+        t_values = fit.t_values(threshold, t_method)
+        with instrumentation.timed("figure"):
+            return full_figure(
+                    x_value, y_value, fit.interval, values, values_1st, values_2nd, t_values, y_range,
+                    )
+
+    if fit.key is None:
+        return build()
+    key = (fit.key, fit.grid_spec, float(threshold), t_method, y_range)
+    return figure_cache.get_or_compute(key, build)
+
+
+# partial update turning the figure of another plant on the same skeleton
+# into this plant's; the curve x arrays are only sent for adaptive grids, the
+# t marker visible flags only where they differ from shown
+# (figures.marker_visibility of the figure in the browser, None if unknown)
+def plant_figure_patch(x_value, y_value, fit, threshold=0.005, t_method=None, y_range=default_y_range,
+                       shown=None):
+    from figures import figure_patch
+
+    t_method = default_t_method if t_method is None else t_method
+    stage_runs["figure_patch"] += 1
+    values, values_1st, values_2nd = fit.values, fit.values_1st, fit.values_2nd
+    t_values = fit.t_values(threshold, t_method)
+    with instrumentation.timed("figure_patch"):
+        return figure_patch(
+                x_value, y_value, fit.interval, values, values_1st, values_2nd, t_values, y_range,
+                with_x=fit.grid_spec.adaptive, shown=shown,
+                )
+
+
+# what the browser's figure skeleton depends on: patches only apply between
+# plants that share it
+def figure_signature(fit, y_range=default_y_range):
+    return repr((tuple(fit.grid_spec), y_range))
+
+
+def _plant_columns(data):
     keys = list(data.keys()).copy()
     keys.remove("x")
+    return {key: data[key] for key in keys}
+
+
+# the exports below build pandas frames. pandas takes far longer to import
+# than this module, so each export imports it on first use
+
+# inferred curves, one column per plant indexed by day. adaptive grids differ
+# per plant, so they are exported in long format (plant, day, value)
+def save_infer_values(data, grid=None, progress=None):
+    import pandas as pd
+
+    grid = default_grid if grid is None else grid
+    fits = fit_plants(data["x"], _plant_columns(data), grid=grid, progress=progress)
 
-    df = {key: generate_values(data["x"], data[key]) for key in keys}
-    df = pd.DataFrame(df)
+    if grid.adaptive:
+        df = pd.concat([
+            pd.DataFrame({"plant": key, "day": fit.interval, "value": fit.values})
+            for key, fit in fits.items()
+            ], ignore_index=True)
+        return df
+
+    day = grid.uniform()
+    df = {key: fit.values for key, fit in fits.items()}
+    df = pd.DataFrame(df, index=pd.Index(day.astype(int) if np.all(day % 1 == 0) else day, name="day"))
     return df
 
 
-def save_t_values(data, threshold=0.005):
-    keys = list(data.keys()).copy()
-    keys.remove("x")
+def save_t_values(data, threshold=0.005, method=None, grid=None, progress=None):
+    import pandas as pd
 
+    method = default_t_method if method is None else method
+    fits = fit_plants(data["x"], _plant_columns(data), grid=grid, progress=progress)
+    if not fits:
+        return pd.DataFrame(index=t_value_index)
+    if method != "grid":
+        df = {}
+        for key, fit in fits.items():
+            res = fit.t_values(threshold, method)
+            df[key] = res["t1"] + res["t2"] + res["t3"] + res["t4"] + res["t5"]
+        return pd.DataFrame(df, index=t_value_index)
+
+    t_values = t_values_batch(
+            np.vstack([fit.values_1st for fit in fits.values()]),
+            np.vstack([fit.values_2nd for fit in fits.values()]),
+            threshold,
+            np.vstack([fit.interval for fit in fits.values()]),
+            )
+    stage_runs["t_values"] += len(fits)
     df = {}
-    for key in keys: 
-        values_1 = generate_values_1st(data["x"], data[key])
-        values_2 = generate_values_2nd(data["x"], data[key])
-        res = t_value_func(values_1, values_2, threshold)
-        df[key] = res["t1"] + res["t2"] + res["t3"] + res["t4"] + res["t5"]
+    for name in t_names:
+        index, value = t_values[name]
+        df[f"{name}_day"] = index
+        df[f"{name}_value"] = value
         
-    df = pd.DataFrame(df, 
-            index=[
-                "t1_day", "t1_value", 
-                "t2_day", "t2_value", 
-                "t3_day", "t3_value", 
-                "t4_day", "t4_value", 
-                "t5_day", "t5_value", 
-                ])
+    df = pd.DataFrame(df, index=list(fits.keys())).T
     return df 
 
-def save_parameters_values(data):
-    keys = list(data.keys()).copy()
-    keys.remove("x")
+
+# one row per parameter of the models used (nan where a plant's model has no
+# such parameter), plus a "model" row when plants were fitted with different models
+def save_parameters_values(data, progress=None):
+    import pandas as pd
+
+    fits = fit_plants(data["x"], _plant_columns(data), progress=progress)
     
-    df = {key: curve_fitting(data["x"], data[key]) for key in keys}
-    df = pd.DataFrame(df, index=["a", "b", "c", "d", "g"])
+    names = [name for name in param_names if any(name in fit.param_names for fit in fits.values())]
+    names = names or list(param_names)
+    df = {key: [fit.parameters.get(name, np.nan) for name in names] for key, fit in fits.items()}
+    df = pd.DataFrame(df, index=names)
+    if len({fit.model for fit in fits.values()}) > 1:
+        df.loc["model"] = [fit.model for fit in fits.values()]
     return df
 
 
+# bootstrap confidence intervals for every plant: estimate / lower / upper
+# rows for the parameters of the models used and the t1-t5 days, plus the
+# number of converged resamples. point estimates come from fit_plants, the
+# resampling runs in chunks of plants on the batch pool. progress counts
+# bootstrapped plants, the fitting before it only checks for cancellation
+def save_bootstrap_values(data, threshold=0.005, grid=None, progress=None, n_resamples=None,
+                          kind=None, level=None, seed=None):
+    import pandas as pd
+
+    columns = _plant_columns(data)
+    report = None if progress is None else lambda done, total: progress(0, total)
+    fits = fit_plants(data["x"], columns, grid=grid, progress=report)
+
+    plants = list(columns)
+    chunks = [plants[i:i + batch_chunksize] for i in range(0, len(plants), batch_chunksize)]
+    settings = (n_resamples, kind, level, seed, threshold)
+    tasks = [(data["x"], [(columns[key], fits[key]) for key in chunk], settings) for chunk in chunks]
+    results = {}
+
+    def store(index, chunk_results):
+        results.update(zip(chunks[index], chunk_results))
+        if progress is not None:
+            progress(len(results), len(plants))
+
+    if progress is not None:
+        progress(0, len(plants))
+    with instrumentation.timed("bootstrap", plants=len(plants)):
+        _run_tasks(_bootstrap_chunk, tasks, store, batch_executor, batch_workers)
+
+    names = [name for name in param_names if any(name in fit.param_names for fit in fits.values())]
+    names = (names or list(param_names)) + t_names
+    index = [f"{name}_{field}" for name in names for field in ("estimate", "lower", "upper")]
+    df = {}
+    for key in plants:
+        intervals = results[key].intervals
+        df[key] = [
+                value for name in names
+                for value in intervals.get(name, (np.nan, np.nan, np.nan))
+                ] + [results[key].converged]
+    df = pd.DataFrame(df, index=index + ["converged_resamples"])
+    return df
+
+
+def _bootstrap_chunk(task):
+    x, items, (n_resamples, kind, level, seed, threshold) = task
+    chunk_results = []
+    for y, fit in items:
+        try:
+            result = bootstrap_plant(x, y, fit, n_resamples, kind, level, seed, threshold)
+        except Exception as e:
+            print(f"Warning: bootstrap failed, {type(e).__name__}: {e}!!!")
+            names = list(fit.param_names) + t_names
+            result = BootstrapResult(
+                    {name: (np.nan, np.nan, np.nan) for name in names},
+                    np.empty((0, len(names))), 0, 0,
+                    )
+        chunk_results.append(result)
+    return chunk_results
+
+
+# compare fitting modes plant by plant: model / jacobian evaluations, wall
+# time, convergence and residual sum of squares. fits bypass the cache
+def fit_mode_report(data, modes=("default", "guided")):
+    import pandas as pd
+
+    x = np.asarray(data["x"], dtype=float)
+    rows = []
+    for key, y in _plant_columns(data).items():
+        y = np.asarray(y, dtype=float)
+        for mode in modes:
+            fit = fit_plant(x, y, fit_mode=mode, use_cache=False)
+            rows.append({
+                "plant": key, "mode": mode, "model": fit.model, "converged": fit.converged,
+                "nfev": fit.nfev, "njev": fit.njev, "seconds": fit.elapsed, "sse": fit.sse,
+                })
+    return pd.DataFrame(rows)
+
+
+# every candidate model per plant with its residual sum of squares, aic and
+# bic, and the one model "best" selects by criterion. the fits go through the
+# batch pool and the fit cache, so a following "best" export refits nothing
+def model_selection_report(data, criterion=None):
+    import pandas as pd
 
+    criterion = default_criterion if criterion is None else criterion
+    columns = _plant_columns(data)
+    selected = fit_plants(data["x"], columns, model="best", criterion=criterion)
+    rows = []
+    for key, y in columns.items():
+        for name in model_candidates:
+            fit = fit_plant(data["x"], y, name)
+            rows.append({
+                "plant": key, "model": name, "converged": fit.converged, "sse": fit.sse,
+                "aic": fit.information_criterion("aic"), "bic": fit.information_criterion("bic"),
+                "seconds": fit.elapsed, "selected": name == selected[key].model,
+                })
+    return pd.DataFrame(rows)
 